@@ -0,0 +1,488 @@
+# bench_codebleu.py
+# Microbenchmarks for the CodeBLEU scorer. Each benchmark prints its timings;
+# run one with e.g. `python bench_codebleu.py parser-pool --n 2000`.
+import argparse
+import random
+import time
+
+NAMES = ['a', 'b', 'c', 'x', 'y', 'total', 'items', 'i', 'j', 'result', 'data', 'key', 'value', 'n']
+
+
+def sample_snippet(rng, n_statements=6):
+    # A small synthetic Python function; deterministic for a given rng.
+    args = rng.sample(NAMES, 3)
+    lines = [f"def f({', '.join(args)}):"]
+    for _ in range(n_statements):
+        target, left, right = rng.choice(NAMES), rng.choice(NAMES), rng.choice(NAMES)
+        kind = rng.random()
+        if kind < 0.5:
+            lines.append(f"    {target} = {left} + {right} * {rng.randint(0, 9)}")
+        elif kind < 0.75:
+            lines.append(f"    for {target} in {left}:")
+            lines.append(f"        {right} += len({target})")
+        else:
+            lines.append(f"    if {left} > {right}:")
+            lines.append(f"        {target} = [{left} for {left} in {right}]")
+    lines.append(f"    return {rng.choice(NAMES)}")
+    return '\n'.join(lines)
+
+
+def sample_snippets(n, n_statements=6, seed=0):
+    rng = random.Random(seed)
+    return [sample_snippet(rng, n_statements) for _ in range(n)]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def best_of(repeat, fn, *args):
+    # The fastest of several runs, which is less sensitive to a noisy machine.
+    runs = [timed(fn, *args) for _ in range(repeat)]
+    return min(seconds for seconds, _ in runs), runs[-1][1]
+
+
+def bench_parser_pool(args):
+    from tree_sitter import Parser
+    from tree_sitter_languages import get_language
+    from parser_pool import get_parser, language_name
+
+    snippets = [bytes(s, 'utf8') for s in sample_snippets(args.n)]
+
+    def without_pool():
+        # What every metric call used to do: a fresh Parser and language lookup.
+        for code in snippets:
+            parser = Parser()
+            parser.set_language(get_language(language_name(args.lang)))
+            parser.parse(code)
+
+    def with_pool():
+        for code in snippets:
+            get_parser(args.lang).parse(code)
+
+    get_parser(args.lang)  # exclude one-time grammar loading from the pooled timing
+    for label, fn in [('without pool', without_pool), ('with pool', with_pool)]:
+        seconds, _ = timed(fn)
+        print(f"{label:>14}: {seconds:.3f}s  ({len(snippets) / seconds:,.0f} parses/s)")
+
+
+def bench_ngram_ids(args):
+    # Ngram extraction, then clipping for both ngram metrics, with tuple ngrams
+    # as before and with packed token ids; the statistics must be identical.
+    from collections import Counter
+    import bleu
+    import weighted_ngram_match
+    import ngram_ids
+
+    references = [s.split() for s in sample_snippets(args.n, seed=0)]
+    hypotheses = [s.split() for s in sample_snippets(args.n, seed=1)]
+    keywords = frozenset(['def', 'for', 'in', 'if', 'return', 'len'])
+
+    def extract_tuples():
+        ref_weights = [{token: 1 if token in keywords else 0.2 for token in ref} for ref in references]
+        return ([bleu.ngram_counts(ref) for ref in references], ref_weights,
+                [bleu.ngram_counts(hyp) for hyp in hypotheses])
+
+    def extract_ids():
+        ref_counts = ngram_ids.batch_ngram_counts(references)
+        hyp_counts = ngram_ids.batch_ngram_counts(hypotheses)
+        # one weight table indexed by token id, shared by all references
+        table = [1 if token in keywords else 0.2 for token in ngram_ids.default_vocab().tokens]
+        return ref_counts, [table] * len(references), hyp_counts
+
+    def clip(extracted):
+        stats = Counter()
+        for ref_counts, ref_weights, hyp_counts in zip(*extracted):
+            for n in range(1, 5):
+                stats['p%d' % n] += bleu.clipped_precision([ref_counts[n - 1]], hyp_counts[n - 1])[0]
+                stats['r%d' % n] += weighted_ngram_match.clipped_recall(
+                    [(ref_counts[n - 1], ref_weights)], hyp_counts[n - 1], n)[0]
+        return stats
+
+    results = {}
+    for label, extract in [('tuple ngrams', extract_tuples), ('packed ids', extract_ids)]:
+        extract_seconds, extracted = best_of(args.repeat, extract)
+        clip_seconds, results[label] = best_of(args.repeat, clip, extracted)
+        print(f"{label:>14}: extract {extract_seconds:.3f}s  clip {clip_seconds:.3f}s"
+              f"  ({len(references) / (extract_seconds + clip_seconds):,.0f} examples/s)")
+    assert results['tuple ngrams'] == results['packed ids'], 'ngram statistics differ'
+    print('statistics identical')
+
+
+def bench_clipped_counts(args):
+    # Clipped counts of all four orders: modified_precision() once per order
+    # against bleu.clipped_counts() in one walk, for growing reference counts.
+    import bleu
+
+    hypotheses = [s.split() for s in sample_snippets(args.n, seed=1)]
+    for n_references in (1, 4, 16):
+        rng = random.Random(n_references)
+        references = [[sample_snippet(rng).split() for _ in range(n_references)] for _ in hypotheses]
+
+        def per_order():
+            return [([p.numerator for p in precisions], [p.denominator for p in precisions])
+                    for precisions in ([bleu.modified_precision(refs, hyp, i) for i in range(1, 5)]
+                                       for refs, hyp in zip(references, hypotheses))]
+
+        def single_pass():
+            return [bleu.clipped_counts(refs, hyp) for refs, hyp in zip(references, hypotheses)]
+
+        old_seconds, old = best_of(args.repeat, per_order)
+        new_seconds, new = best_of(args.repeat, single_pass)
+        assert old == new, 'clipped counts differ'
+        print(f"{n_references:>2} references: per order {old_seconds:.3f}s  single pass {new_seconds:.3f}s"
+              f"  ({old_seconds / new_seconds:.1f}x)")
+
+
+def bench_ngram_match(args):
+    # Both ngram metrics of CodeBLEU from precomputed counts: clipped_precision()
+    # and clipped_recall() per order, against one ngram_match.match_counts().
+    import bleu
+    import weighted_ngram_match
+    import ngram_ids
+    import ngram_match
+
+    keywords = frozenset(['def', 'for', 'in', 'if', 'return', 'len'])
+    hypotheses = ngram_ids.batch_ngram_counts([s.split() for s in sample_snippets(args.n, seed=1)])
+    rng = random.Random(4)
+    references = ngram_ids.batch_ngram_counts([sample_snippet(rng).split() for _ in range(4 * args.n)])
+    table = [1 if token in keywords else 0.2 for token in ngram_ids.default_vocab().tokens]
+    examples = [(references[4 * i:4 * i + 4], hyp) for i, hyp in enumerate(hypotheses)]
+
+    def separate():
+        stats = []
+        for refs, hyp in examples:
+            for n in range(1, 5):
+                stats.append(bleu.clipped_precision([ref[n - 1] for ref in refs], hyp[n - 1]))
+                stats.append(weighted_ngram_match.clipped_recall([(ref[n - 1], table) for ref in refs], hyp[n - 1], n))
+        return stats
+
+    def unified():
+        stats = []
+        for refs, hyp in examples:
+            match = ngram_match.match_counts(refs, hyp, [table] * len(refs))
+            for i in range(4):
+                stats.append((match.p_numerators[i], match.p_denominators[i]))
+                stats.append((match.r_numerators[i], match.r_denominators[i]))
+        return stats
+
+    old_seconds, old = best_of(args.repeat, separate)
+    new_seconds, new = best_of(args.repeat, unified)
+    assert old == new, 'ngram statistics differ'
+    print(f"separate passes: {old_seconds:.3f}s  unified pass: {new_seconds:.3f}s  ({old_seconds / new_seconds:.1f}x)")
+
+
+def bench_syntax_hash(args):
+    # Syntax match of reference/hypothesis pairs of growing size: subtree
+    # s-expressions matched by list scans, against structural hashes matched
+    # as multisets. Match counts must be identical.
+    import syntax_match
+    from parser_pool import get_parser
+
+    parser = get_parser(args.lang)
+    for n_statements in [6, 100, 1000]:
+        n = max(2, args.n * 6 // n_statements)  # about the same amount of code each time
+        pairs = [(parser.parse(bytes(ref, 'utf8')).root_node, parser.parse(bytes(hyp, 'utf8')).root_node)
+                 for ref, hyp in zip(sample_snippets(n, n_statements, seed=0), sample_snippets(n, n_statements, seed=1))]
+
+        def sexps():
+            return [syntax_match.count_sub_tree_matches(syntax_match.sub_tree_sexps(ref), syntax_match.sub_tree_sexps(hyp))
+                    for ref, hyp in pairs]
+
+        def hashes():
+            return [syntax_match.count_sub_tree_hash_matches(syntax_match.sub_tree_hashes(ref), syntax_match.sub_tree_hashes(hyp))
+                    for ref, hyp in pairs]
+
+        old_seconds, old = best_of(args.repeat, sexps)
+        new_seconds, new = best_of(args.repeat, hashes)
+        assert old == new, 'syntax match counts differ'
+        print(f"{n:>5} pairs of {n_statements:>4} statements: s-expressions {old_seconds:.3f}s"
+              f"  hashes {new_seconds:.3f}s  ({old_seconds / new_seconds:.1f}x)")
+
+
+def list_dataflow_matches(normalized_ref_dfg, normalized_cand_dfg):
+    # dataflow_match.count_dataflow_matches() as it was: a list scan and
+    # removal per reference dataflow.
+    match_count = 0
+    temp_normalized_cand_dfg = list(normalized_cand_dfg)
+    for dataflow in normalized_ref_dfg:
+        if dataflow in temp_normalized_cand_dfg:
+            match_count += 1
+            temp_normalized_cand_dfg.remove(dataflow)
+    return match_count, len(normalized_ref_dfg)
+
+
+def bench_dataflow_match(args):
+    # Matching the normalized data flows of reference/hypothesis pairs of
+    # growing size, by list removal and by multiset counts. Extraction is not
+    # timed; match counts must be identical.
+    import dataflow_match
+
+    for n_statements in [6, 100, 1000]:
+        n = max(2, args.n * 6 // n_statements)
+        pairs = [(dataflow_match.snippet_dataflow(ref, args.lang), dataflow_match.snippet_dataflow(hyp, args.lang))
+                 for ref, hyp in zip(sample_snippets(n, n_statements, seed=0), sample_snippets(n, n_statements, seed=1))]
+
+        def lists():
+            return [list_dataflow_matches(ref, hyp) for ref, hyp in pairs]
+
+        def counters():
+            return [dataflow_match.count_dataflow_matches(ref, hyp) for ref, hyp in pairs]
+
+        old_seconds, old = best_of(args.repeat, lists)
+        new_seconds, new = best_of(args.repeat, counters)
+        assert old == new, 'dataflow match counts differ'
+        print(f"{n:>5} pairs of {n_statements:>4} statements: list removal {old_seconds:.3f}s"
+              f"  multisets {new_seconds:.3f}s  ({old_seconds / new_seconds:.1f}x)")
+
+
+def load_reference_parser(directory):
+    # The CodeXGLUE CodeBLEU `parser` package from a checkout, imported under
+    # another name so it does not clash with the bundled one.
+    import importlib.util
+    import os
+    import sys
+
+    spec = importlib.util.spec_from_file_location('reference_parser', os.path.join(directory, '__init__.py'),
+                                                  submodule_search_locations=[directory])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['reference_parser'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_dfg(args):
+    # Token indexing and DFG extraction of the bundled parser package, on
+    # generated functions of growing size and on deeply nested code. With
+    # --reference-parser, the recursive CodeXGLUE implementation is timed too
+    # and its output must be identical.
+    import parser as bundled
+    from parser_pool import get_parser
+
+    implementations = [('bundled', bundled)]
+    if args.reference_parser:
+        implementations.append(('CodeXGLUE', load_reference_parser(args.reference_parser)))
+    ts_parser = get_parser(args.lang)
+
+    def extract(module, trees):
+        dfgs = []
+        for root_node, code_lines in trees:
+            try:
+                tokens_index = module.tree_to_token_index(root_node)
+                index_to_code = {index: (idx, module.index_to_code_token(index, code_lines))
+                                 for idx, index in enumerate(tokens_index)}
+                dfgs.append(module.DFG_python(root_node, index_to_code, {})[0])
+            except RecursionError:
+                dfgs.append('RecursionError')
+        return dfgs
+
+    workloads = [(f"{max(2, args.n * 6 // n_statements)} x {n_statements} statements",
+                  sample_snippets(max(2, args.n * 6 // n_statements), n_statements))
+                 for n_statements in [6, 100, 1000]]
+    workloads.append(("3000-term sum", ["x = " + " + ".join(f"v{i}" for i in range(3000))]))
+    for label, codes in workloads:
+        trees = [(ts_parser.parse(bytes(code, 'utf8')).root_node, code.split('\n')) for code in codes]
+        timings, outputs = [], []
+        for name, module in implementations:
+            seconds, dfgs = best_of(args.repeat, extract, module, trees)
+            failed = dfgs.count('RecursionError')
+            timings.append(f"{name} {seconds:.3f}s" + (f" ({failed} RecursionError)" if failed else ""))
+            outputs.append(dfgs)
+        for dfgs in outputs[1:]:
+            assert all(old == 'RecursionError' or old == new for new, old in zip(outputs[0], dfgs)), 'DFGs differ'
+        print(f"{label:>24}: " + "  ".join(timings))
+
+
+def with_comments(code, rng):
+    # code with a docstring, comment lines and trailing comments added.
+    lines = code.split('\n')
+    out = [lines[0], '    """Docstring of f."""']
+    for line in lines[1:]:
+        indent = line[:len(line) - len(line.lstrip())]
+        if rng.random() < 0.2:
+            out.append(f"{indent}# comment {rng.randint(0, 99)}")
+        out.append(line + ('  # trailing' if rng.random() < 0.1 else ''))
+    return '\n'.join(out)
+
+
+def bench_clean(args):
+    # Comment and docstring removal plus parsing of Python snippets: the
+    # tokenize-based clean_code() and a parse of its output, against
+    # clean_and_parse() finding them in the tree. Trees must be identical.
+    import preprocess
+    from parser_pool import get_parser
+
+    ts_parser = get_parser('python')
+    rng = random.Random(3)
+    plain = sample_snippets(args.n)
+    workloads = [('without comments', plain), ('with comments', [with_comments(code, rng) for code in plain]),
+                 ('long with comments', [with_comments(code, rng) for code in sample_snippets(max(2, args.n // 50), 300)])]
+
+    def tokenized(codes):
+        return [ts_parser.parse(bytes(preprocess.clean_code(code, 'python'), 'utf8')) for code in codes]
+
+    def from_tree(codes):
+        return [preprocess.clean_and_parse(code, 'python', ts_parser)[1] for code in codes]
+
+    for label, codes in workloads:
+        old_seconds, old = best_of(args.repeat, tokenized, codes)
+        new_seconds, new = best_of(args.repeat, from_tree, codes)
+        assert [tree.root_node.sexp() for tree in old] == [tree.root_node.sexp() for tree in new], 'trees differ'
+        print(f"{label:>18}: tokenize and parse {old_seconds:.3f}s  parse and splice {new_seconds:.3f}s"
+              f"  ({old_seconds / new_seconds:.1f}x)")
+
+
+def bench_data_flow(args):
+    # dataflow_match.get_data_flow() of Python functions of growing size: the
+    # token index, DFG_python(), sorting, filtering and merging one after the
+    # other, against the fused byte-offset extractor. Normalized data flows
+    # must be identical.
+    import dataflow_match
+    from parser import DFG_python
+    from parser_pool import get_parser
+
+    ts_parser = get_parser('python')
+    separate = [ts_parser, lambda *dfg_args: DFG_python(*dfg_args)]  # not in fused_data_flow_function
+    fused = [ts_parser, DFG_python]
+    for n_statements in [6, 100, 1000, 5000]:
+        n = max(2, args.n * 6 // n_statements)
+        codes = sample_snippets(n, n_statements)
+        trees = [ts_parser.parse(bytes(code, 'utf8')) for code in codes]
+
+        def extract(parser_info):
+            return [dataflow_match.normalize_dataflow(dataflow_match.get_data_flow(code, parser_info, tree))
+                    for code, tree in zip(codes, trees)]
+
+        old_seconds, old = best_of(args.repeat, extract, separate)
+        new_seconds, new = best_of(args.repeat, extract, fused)
+        assert old == new, 'data flows differ'
+        print(f"{n:>5} x {n_statements:>4} statements: separate passes {old_seconds:.3f}s"
+              f"  fused {new_seconds:.3f}s  ({old_seconds / new_seconds:.1f}x)")
+
+
+def bench_feature_cache(args):
+    # Featurizing snippets with no cache, into an empty FeatureStore and, as a
+    # later run would, from the filled store with a fresh in-memory cache.
+    # Features must be identical.
+    import shutil
+    import tempfile
+    import features
+
+    codes = sample_snippets(args.n, 20)
+    directory = tempfile.mkdtemp()
+    try:
+        def extract():
+            return features.snippets_features(codes, args.lang)
+
+        def cached():
+            cache = features.FeatureCache(args.lang, cache_dir=directory)
+            result = cache.get_many(codes)
+            cache.store.close()
+            return result
+
+        old_seconds, old = best_of(args.repeat, extract)
+        cold_seconds, _ = timed(cached)
+        warm_seconds, new = best_of(args.repeat, cached)
+        assert old == new, 'features differ'
+        print(f"{args.n} snippets: no cache {old_seconds:.3f}s  empty store {cold_seconds:.3f}s"
+              f"  filled store {warm_seconds:.3f}s  ({old_seconds / warm_seconds:.1f}x)")
+    finally:
+        shutil.rmtree(directory)
+
+
+def syntax_dataflow_stats(references, candidates, lang):
+    import dataflow_match
+    import syntax_match
+    return (syntax_match.corpus_syntax_match_stats(references, candidates, lang),
+            dataflow_match.corpus_dataflow_match_stats(references, candidates, lang))
+
+
+def bench_threads(args):
+    # Syntax and dataflow match of corpora of growing size: in one thread, with
+    # the unique snippets cleaned, parsed and featurized on thread pools (a
+    # parser per thread), and split into shards scored by process pools (pool
+    # start-up included). Counts must be identical. tree-sitter 0.21 holds the
+    # GIL while it parses, so threads run one at a time; this is why corpus
+    # scoring has no threaded mode and --workers uses processes.
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    import dataflow_match
+    import preprocess
+    import syntax_match
+    from parser_pool import get_parser
+
+    def snippet_features(code):
+        cleaned, tree = preprocess.clean_and_parse(code, args.lang, get_parser(args.lang))
+        return (syntax_match._tree_hashes(tree),
+                dataflow_match.dataflow_counts(dataflow_match.snippet_dataflow(cleaned, args.lang, tree)))
+
+    def threaded(references, candidates, workers):
+        snippets = {}
+        for references_sample, candidate in zip(references, candidates):
+            for code in [candidate] + references_sample:
+                snippets.setdefault(preprocess.code_hash(code), code)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            features = dict(zip(snippets, executor.map(snippet_features, snippets.values())))
+        syntax, dataflow = (0, 0), (0, 0)
+        for references_sample, candidate in zip(references, candidates):
+            candidate_hashes, candidate_counts = features[preprocess.code_hash(candidate)]
+            for reference in references_sample:
+                reference_hashes, reference_counts = features[preprocess.code_hash(reference)]
+                if reference_hashes is not None and candidate_hashes is not None:
+                    pair = syntax_match.count_sub_tree_hash_matches(reference_hashes, candidate_hashes)
+                    syntax = (syntax[0] + pair[0], syntax[1] + pair[1])
+                pair = dataflow_match.count_dataflow_key_matches(reference_counts, candidate_counts)
+                dataflow = (dataflow[0] + pair[0], dataflow[1] + pair[1])
+        return syntax, dataflow
+
+    def sharded(references, candidates, workers):
+        shard_size = -(-len(candidates) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(syntax_dataflow_stats, references[i:i + shard_size],
+                                       candidates[i:i + shard_size], args.lang)
+                       for i in range(0, len(candidates), shard_size)]
+            results = [future.result() for future in futures]
+        return tuple(tuple(map(sum, zip(*counts))) for counts in zip(*results))
+
+    for n in [max(8, args.n // 10), args.n, args.n * 4]:
+        references = [[code] for code in sample_snippets(n, 20, seed=0)]
+        candidates = sample_snippets(n, 20, seed=1)
+        serial_seconds, serial = best_of(args.repeat, syntax_dataflow_stats, references, candidates, args.lang)
+        timings = []
+        for workers in [2, 4, 8]:
+            seconds, result = best_of(args.repeat, threaded, references, candidates, workers)
+            assert result == serial, 'threaded counts differ'
+            timings.append(f"{workers} threads {seconds:.3f}s")
+        for workers in [2, 4]:
+            seconds, result = best_of(args.repeat, sharded, references, candidates, workers)
+            assert result == serial, 'sharded counts differ'
+            timings.append(f"{workers} processes {seconds:.3f}s")
+        print(f"{n:>5} pairs: 1 thread {serial_seconds:.3f}s  " + '  '.join(timings))
+
+
+BENCHMARKS = {
+    'parser-pool': bench_parser_pool,
+    'ngram-ids': bench_ngram_ids,
+    'clipped-counts': bench_clipped_counts,
+    'ngram-match': bench_ngram_match,
+    'syntax-hash': bench_syntax_hash,
+    'dataflow-match': bench_dataflow_match,
+    'dfg': bench_dfg,
+    'clean': bench_clean,
+    'data-flow': bench_data_flow,
+    'feature-cache': bench_feature_cache,
+    'threads': bench_threads,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='CodeBLEU microbenchmarks')
+    arg_parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    arg_parser.add_argument('--n', type=int, default=2000, help='number of snippets/examples')
+    arg_parser.add_argument('--lang', type=str, default='python')
+    arg_parser.add_argument('--repeat', type=int, default=3, help='report the fastest of this many runs')
+    arg_parser.add_argument('--reference-parser', type=str, default=None,
+                            help='directory of the CodeXGLUE CodeBLEU parser package to compare with (dfg)')
+    args = arg_parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -16,6 +16,7 @@ import warnings
 from collections import Counter
 
 from utils import ngrams
+import ngram_match
 import pdb
 
 
@@ -141,30 +142,162 @@ def corpus_bleu(
     :return: The corpus-level BLEU score.
     :rtype: float
     """
-    # Before proceeding to compute BLEU, perform sanity checks.
+    stats = corpus_bleu_stats(list_of_references, hypotheses, len(weights))
+    # Smoothing methods 4-7 look at the last hypothesis and its references,
+    # as they did when the statistics were collected inline.
+    references = list_of_references[-1] if list_of_references else []
+    hypothesis = hypotheses[-1] if hypotheses else []
+    return corpus_bleu_from_stats(
+        stats, weights, smoothing_function, auto_reweigh, references, hypothesis
+    )
 
-    p_numerators = Counter()  # Key = ngram order, and value = no. of ngram matches.
-    p_denominators = Counter()  # Key = ngram order, and value = no. of ngram in ref.
-    hyp_lengths, ref_lengths = 0, 0
 
+def corpus_bleu_stats(list_of_references, hypotheses, max_n=4):
+    """
+    Collect the sufficient statistics of corpus_bleu(): the numerators and
+    denominators of every ngram order up to max_n plus the hypothesis and
+    closest reference lengths. The statistics of disjoint parts of a corpus
+    sum to those of the whole corpus (see merge_bleu_stats()), so they can be
+    computed per shard and reduced into the same corpus score.
+    :param list_of_references: a corpus of lists of reference sentences, w.r.t. hypotheses
+    :type list_of_references: list(list(list(str)))
+    :param hypotheses: a list of hypothesis sentences
+    :type hypotheses: list(list(str))
+    :param max_n: the highest ngram order
+    :type max_n: int
+    :return: (p_numerators, p_denominators, hyp_lengths, ref_lengths)
+    :rtype: tuple(Counter, Counter, int, int)
+    """
+    # Before proceeding to compute BLEU, perform sanity checks.
     assert len(list_of_references) == len(hypotheses), (
         "The number of hypotheses and their reference(s) should be the " "same "
     )
 
+    accumulator = BleuAccumulator(max_n)
     # Iterate through each hypothesis and their corresponding references.
     for references, hypothesis in zip(list_of_references, hypotheses):
-        # For each order of ngram, calculate the numerator and
-        # denominator for the corpus-level modified precision.
-        for i, _ in enumerate(weights, start=1):
-            p_i = modified_precision(references, hypothesis, i)
-            p_numerators[i] += p_i.numerator
-            p_denominators[i] += p_i.denominator
+        accumulator.add(references, hypothesis)
+    return accumulator.stats()
+
+
+class BleuAccumulator:
+    """
+    Incrementally collects the statistics of corpus_bleu(), one example at a
+    time, so a corpus can be scored while it is streamed from disk or as
+    hypotheses are generated. Only integer clipped counts and ngram counts
+    per order and the two length totals are kept, and accumulators of
+    disjoint parts of a corpus merge into that of the whole:
+        >>> hyp1 = 'the cat sat on the mat'.split()
+        >>> ref1 = 'the cat is on the mat'.split()
+        >>> hyp2 = 'he read the book'.split()
+        >>> ref2 = 'he read a book'.split()
+        >>> shard1 = BleuAccumulator().add([ref1], hyp1)
+        >>> shard2 = BleuAccumulator().add([ref2], hyp2)
+        >>> shard1.merge(shard2).score() == corpus_bleu([[ref1], [ref2]], [hyp1, hyp2])
+        True
+    """
+
+    def __init__(self, max_n=4):
+        self.max_n = max_n
+        self.p_numerators = [0] * (max_n + 1)  # Index = ngram order, and value = no. of ngram matches.
+        self.p_denominators = [0] * (max_n + 1)  # Index = ngram order, and value = no. of ngram in hyp.
+        self.hyp_lengths = 0
+        self.ref_lengths = 0
+        # The last example seen, for smoothing methods 4-7 (see corpus_bleu()).
+        self.references = []
+        self.hypothesis = []
+
+    def add(self, references, hypothesis):
+        """
+        Add one hypothesis and its references.
+        :type references: list(list(str))
+        :type hypothesis: list(str)
+        :return: self
+        """
+        # Calculate the numerator and denominator for the corpus-level
+        # modified precision of every order of ngram at once.
+        numerators, denominators = clipped_counts(references, hypothesis, self.max_n)
+        for i in range(1, self.max_n + 1):
+            self.p_numerators[i] += numerators[i - 1]
+            self.p_denominators[i] += denominators[i - 1]
 
         # Calculate the hypothesis length and the closest reference length.
         # Adds them to the corpus-level hypothesis and reference counts.
         hyp_len = len(hypothesis)
-        hyp_lengths += hyp_len
-        ref_lengths += closest_ref_length(references, hyp_len)
+        self.hyp_lengths += hyp_len
+        self.ref_lengths += closest_ref_length(references, hyp_len)
+        self.references, self.hypothesis = references, hypothesis
+        return self
+
+    def merge(self, other):
+        """
+        Add the statistics of another accumulator, collected after this one's.
+        :type other: BleuAccumulator
+        :return: self
+        """
+        assert self.max_n == other.max_n, "Only accumulators of the same ngram orders can be merged"
+        for i in range(1, self.max_n + 1):
+            self.p_numerators[i] += other.p_numerators[i]
+            self.p_denominators[i] += other.p_denominators[i]
+        self.hyp_lengths += other.hyp_lengths
+        self.ref_lengths += other.ref_lengths
+        if other.hypothesis or other.references:
+            self.references, self.hypothesis = other.references, other.hypothesis
+        return self
+
+    def stats(self):
+        """
+        The statistics collected so far, as returned by corpus_bleu_stats().
+        :rtype: tuple(Counter, Counter, int, int)
+        """
+        orders = range(1, self.max_n + 1)
+        p_numerators = Counter({i: self.p_numerators[i] for i in orders})
+        p_denominators = Counter({i: self.p_denominators[i] for i in orders})
+        return p_numerators, p_denominators, self.hyp_lengths, self.ref_lengths
+
+    def score(self, weights=(0.25, 0.25, 0.25, 0.25), smoothing_function=None, auto_reweigh=False):
+        """
+        The corpus_bleu() of all examples added so far.
+        :rtype: float
+        """
+        assert len(weights) <= self.max_n, "Statistics were not collected for every weighted ngram order"
+        return corpus_bleu_from_stats(
+            self.stats(), weights, smoothing_function, auto_reweigh, self.references, self.hypothesis
+        )
+
+
+def merge_bleu_stats(stats, other):
+    """
+    Add up two sets of statistics returned by corpus_bleu_stats().
+    :rtype: tuple(Counter, Counter, int, int)
+    """
+    p_numerators = Counter(stats[0])
+    p_numerators.update(other[0])
+    p_denominators = Counter(stats[1])
+    p_denominators.update(other[1])
+    return p_numerators, p_denominators, stats[2] + other[2], stats[3] + other[3]
+
+
+def corpus_bleu_from_stats(
+    stats,
+    weights=(0.25, 0.25, 0.25, 0.25),
+    smoothing_function=None,
+    auto_reweigh=False,
+    references=None,
+    hypothesis=None,
+):
+    """
+    Calculate the corpus-level BLEU score from corpus_bleu_stats().
+    :param stats: statistics collected for at least len(weights) ngram orders
+    :type stats: tuple(Counter, Counter, int, int)
+    :param references: references of one example, only used by smoothing methods 4-7
+    :type references: list(list(str))
+    :param hypothesis: hypothesis of one example, only used by smoothing methods 4-7
+    :type hypothesis: list(str)
+    :return: The corpus-level BLEU score.
+    :rtype: float
+    """
+    p_numerators, p_denominators, hyp_lengths, ref_lengths = stats
 
     # Calculate corpus-level brevity penalty.
     bp = brevity_penalty(ref_lengths, hyp_lengths)
@@ -277,13 +410,45 @@ def modified_precision(references, hypothesis, n):
     # Set an empty Counter if hypothesis is empty.
 
     counts = Counter(ngrams(hypothesis, n)) if len(hypothesis) >= n else Counter()
+    references_counts = [
+        Counter(ngrams(reference, n)) if len(reference) >= n else Counter()
+        for reference in references
+    ]
+    numerator, denominator = clipped_precision(references_counts, counts)
+
+    return Fraction(numerator, denominator, _normalize=False)
+
+
+def ngram_counts(tokens, max_n=4):
+    """
+    Count the ngrams of every order from 1 to max_n, as modified_precision()
+    does for a single order. Precomputed counts let the same sentence be
+    matched against many others without extracting its ngrams again.
+    :param tokens: A tokenized sentence.
+    :type tokens: list(str)
+    :param max_n: The highest ngram order.
+    :type max_n: int
+    :return: The ngram counts of order n at index n - 1.
+    :rtype: list(Counter)
+    """
+    return ngram_match.count_ngrams(tokens, max_n)
+
+
+def clipped_precision(references_counts, counts):
+    """
+    Calculate the numerator and denominator of modified_precision() from
+    ngram counts of a single order.
+    :param references_counts: The ngram counts of each reference.
+    :type references_counts: list(Counter)
+    :param counts: The ngram counts of the hypothesis.
+    :type counts: Counter
+    :return: The clipped ngram matches and the number of hypothesis ngrams.
+    :rtype: tuple(int, int)
+    """
     # Extract a union of references' counts.
     # max_counts = reduce(or_, [Counter(ngrams(ref, n)) for ref in references])
     max_counts = {}
-    for reference in references:
-        reference_counts = (
-            Counter(ngrams(reference, n)) if len(reference) >= n else Counter()
-        )
+    for reference_counts in references_counts:
         for ngram in counts:
             max_counts[ngram] = max(max_counts.get(ngram, 0), reference_counts[ngram])
 
@@ -297,7 +462,31 @@ def modified_precision(references, hypothesis, n):
     # Usually this happens when the ngram order is > len(reference).
     denominator = max(1, sum(counts.values()))
 
-    return Fraction(numerator, denominator, _normalize=False)
+    return numerator, denominator
+
+
+def clipped_counts(references, hypothesis, max_n=4):
+    """
+    Calculate the numerators and denominators of modified_precision() for
+    every ngram order from 1 to max_n at once, with a single walk over the
+    hypothesis and each reference (see ngram_match.match_tokens()).
+        >>> reference1 = 'the cat is on the mat'.split()
+        >>> reference2 = 'there is a cat on the mat'.split()
+        >>> hypothesis1 = 'the the the the the the the'.split()
+        >>> clipped_counts([reference1, reference2], hypothesis1)
+        ([2, 0, 0, 0], [7, 6, 5, 4])
+    :param references: A list of reference translations.
+    :type references: list(list(str))
+    :param hypothesis: A hypothesis translation.
+    :type hypothesis: list(str)
+    :param max_n: The highest ngram order.
+    :type max_n: int
+    :return: The clipped ngram matches and the number of hypothesis ngrams,
+        of order n at index n - 1.
+    :rtype: tuple(list(int), list(int))
+    """
+    match = ngram_match.match_tokens(references, hypothesis, max_n=max_n, recall=False)
+    return match.p_numerators, match.p_denominators
 
 
 def closest_ref_length(references, hyp_len):
@@ -3,76 +3,139 @@
 
 # -*- coding:utf-8 -*-
 import argparse
-import bleu
-import weighted_ngram_match
-import syntax_match
-import dataflow_match
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--refs', type=str, nargs='+', required=True,
-                        help='reference files')
-parser.add_argument('--hyp', type=str, required=True, 
-                        help='hypothesis file')
-parser.add_argument('--lang', type=str, required=True, 
-                        choices=['java','js','c_sharp','php','go','python','ruby'],
-                        help='programming language')
-parser.add_argument('--params', type=str, default='0.25,0.25,0.25,0.25',
-                        help='alpha, beta and gamma')
-
-args = parser.parse_args()
-
-lang = args.lang
-alpha,beta,gamma,theta = [float(x) for x in args.params.split(',')]
-
-# preprocess inputs
-pre_references = [[x.strip() for x in open(file, 'r', encoding='utf-8').readlines()] \
-                for file in args.refs]
-hypothesis = [x.strip() for x in open(args.hyp, 'r', encoding='utf-8').readlines()]
-
-for i in range(len(pre_references)):
-    assert len(hypothesis) == len(pre_references[i])
-
-references = []
-for i in range(len(hypothesis)):
-    ref_for_instance = []
-    for j in range(len(pre_references)):
-        ref_for_instance.append(pre_references[j][i])
-    references.append(ref_for_instance)
-assert len(references) == len(pre_references)*len(hypothesis)
-
-
-# calculate ngram match (BLEU)
-tokenized_hyps = [x.split() for x in hypothesis]
-tokenized_refs = [[x.split() for x in reference] for reference in references]
-
-ngram_match_score = bleu.corpus_bleu(tokenized_refs,tokenized_hyps)
-
-# calculate weighted ngram match
-keywords = [x.strip() for x in open('keywords/'+args.lang+'.txt', 'r', encoding='utf-8').readlines()]
-def make_weights(reference_tokens, key_word_list):
-    return {token:1 if token in key_word_list else 0.2 \
-            for token in reference_tokens}
-tokenized_refs_with_weights = [[[reference_tokens, make_weights(reference_tokens, keywords)]\
-            for reference_tokens in reference] for reference in tokenized_refs]
-
-weighted_ngram_match_score = weighted_ngram_match.corpus_bleu(tokenized_refs_with_weights,tokenized_hyps)
-
-# calculate syntax match
-syntax_match_score = syntax_match.corpus_syntax_match(references, hypothesis, args.lang)
-
-# calculate dataflow match
-dataflow_match_score = dataflow_match.corpus_dataflow_match(references, hypothesis, args.lang)
-
-print('ngram match: {0}, weighted ngram match: {1}, syntax_match: {2}, dataflow_match: {3}'.\
-                    format(ngram_match_score, weighted_ngram_match_score, syntax_match_score, dataflow_match_score))
-
-code_bleu_score = alpha*ngram_match_score\
-                + beta*weighted_ngram_match_score\
-                + gamma*syntax_match_score\
-                + theta*dataflow_match_score
-
-print('CodeBLEU score: ', code_bleu_score)
-
-
-
-
+import os
+from itertools import zip_longest
+
+import codebleu
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--refs', type=str, nargs='+',
+                            help='reference files: one example per line, or a single JSONL file of {"id", "refs"} records')
+    parser.add_argument('--hyp', type=str, nargs='+',
+                            help='hypothesis files, one per system, optionally named as name=path: '
+                                 'one example per line, or JSONL files of {"id", "hyp"} records')
+    parser.add_argument('--input', type=str, default=None,
+                            help='JSONL file of {"id", "refs", "hyp"} records, instead of --refs/--hyp')
+    parser.add_argument('--lang', type=str, required=True, 
+                            choices=codebleu.keyword_languages(),
+                            help='programming language (one with a keyword list in keywords/)')
+    parser.add_argument('--params', type=str, default='0.25,0.25,0.25,0.25',
+                            help='alpha, beta and gamma')
+    parser.add_argument('--workers', type=int, default=1,
+                            help='number of processes scoring shards of the corpus in parallel')
+    parser.add_argument('--sentence-output', type=str, default=None,
+                            help='stream per-example scores to this file (JSONL, or CSV if it ends in .csv)')
+    parser.add_argument('--feature-cache', '--reference-cache', dest='feature_cache', type=str, default=None,
+                            help='directory caching reference and hypothesis features across runs and systems')
+    args = parser.parse_args()
+    if args.input:
+        if args.refs or args.hyp:
+            parser.error('--input already holds the references and hypotheses; drop --refs/--hyp')
+    elif not (args.refs and args.hyp):
+        parser.error('either --input or both --refs and --hyp are required')
+    else:
+        args.systems, args.hyp = zip(*[parse_system(spec) for spec in args.hyp])
+        if len(set(args.systems)) != len(args.systems):
+            parser.error('system names must be unique; name them as name=path')
+        jsonl = [path.endswith('.jsonl') for path in list(args.refs) + list(args.hyp)]
+        if any(jsonl) and not all(jsonl):
+            parser.error('--refs and --hyp files must be all JSONL (.jsonl) or all plain text')
+        if all(jsonl) and len(args.refs) != 1:
+            parser.error('a JSONL --hyp needs exactly one JSONL --refs file holding all references')
+    if args.sentence_output and args.workers > 1:
+        parser.error('--sentence-output scores examples one at a time; it cannot be combined with --workers')
+    return args
+
+
+def parse_system(spec):
+    # 'name=path' names a system; a bare path is named after its file.
+    name, sep, path = spec.partition('=')
+    if not sep or os.path.exists(spec):
+        path = spec
+        name = os.path.splitext(os.path.basename(spec))[0]
+    return name, path
+
+
+def iter_line_examples(ref_files, hyp_files):
+    # Lazily yields (line number, references, hypotheses), one line per example
+    # and one hypothesis per system.
+    files = [open(file, 'r', encoding='utf-8') for file in hyp_files] \
+          + [open(file, 'r', encoding='utf-8') for file in ref_files]
+    n_systems = len(hyp_files)
+    try:
+        for i, lines in enumerate(zip_longest(*files)):
+            if None in lines:
+                raise ValueError('reference and hypothesis files have different numbers of lines')
+            yield i, [x.strip() for x in lines[n_systems:]], tuple(x.strip() for x in lines[:n_systems])
+    finally:
+        for f in files:
+            f.close()
+
+
+def iter_examples(args):
+    # All inputs are read lazily, so corpora larger than memory can be scored.
+    # Every example carries one hypothesis per system.
+    if args.input:
+        return ((i, refs, (hyp,)) for i, refs, hyp in codebleu.iter_jsonl_examples(args.input))
+    if args.hyp[0].endswith('.jsonl'):
+        return codebleu.iter_aligned_jsonl_systems(args.refs[0], args.hyp)
+    return iter_line_examples(args.refs, args.hyp)
+
+
+def print_comparison(systems, scores, params):
+    columns = ['ngram match', 'weighted ngram match', 'syntax_match', 'dataflow_match', 'CodeBLEU']
+    width = max(len('system'), *(len(system) for system in systems))
+    print('  '.join(['system'.ljust(width)] + columns))
+    for system, system_scores in zip(systems, scores):
+        values = tuple(system_scores) + (codebleu.code_bleu(system_scores, params),)
+        print('  '.join([system.ljust(width)] + ['{0:.4f}'.format(value).rjust(len(column))
+                                                  for value, column in zip(values, columns)]))
+
+
+def main():
+    args = parse_args()
+
+    lang = args.lang
+    alpha,beta,gamma,theta = [float(x) for x in args.params.split(',')]
+
+    keywords = codebleu.load_keywords(lang)
+    systems = list(args.systems) if not args.input else ['hyp']
+    examples = iter_examples(args)
+    # references are featurized once and shared by every system; with
+    # --feature-cache, snippets featurized by an earlier run are not parsed again
+    reference_cache = codebleu.ReferenceCache(lang, keywords, args.feature_cache)
+    params = (alpha, beta, gamma, theta)
+
+    if args.sentence_output:
+        # per-example scores are streamed as they are computed; the corpus
+        # scores below come from the same statistics
+        with_system = len(systems) > 1
+        with codebleu.SentenceWriter(args.sentence_output, with_system) as writer:
+            stats = codebleu.score_systems_examples(examples, systems if with_system else [None], lang, keywords,
+                                                    params, writer.write, reference_cache)
+    else:
+        # ngram match (BLEU), weighted ngram match, syntax match and dataflow match,
+        # each reduced from per-shard sufficient statistics
+        stats = codebleu.stream_systems_stats(examples, len(systems), lang, keywords, workers=args.workers,
+                                              reference_cache=reference_cache, cache_dir=args.feature_cache)
+
+    scores = [codebleu.scores_from_stats(system_stats) for system_stats in stats]
+
+    if len(systems) > 1:
+        print_comparison(systems, scores, params)
+        return
+
+    ngram_match_score, weighted_ngram_match_score, syntax_match_score, dataflow_match_score = scores[0]
+
+    print('ngram match: {0}, weighted ngram match: {1}, syntax_match: {2}, dataflow_match: {3}'.\
+                        format(ngram_match_score, weighted_ngram_match_score, syntax_match_score, dataflow_match_score))
+
+    code_bleu_score = codebleu.code_bleu(scores[0], params)
+
+    print('CodeBLEU score: ', code_bleu_score)
+
+
+if __name__ == '__main__':
+    main()
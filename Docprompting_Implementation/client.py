@@ -0,0 +1,150 @@
+# client.py
+# Thin client of the DocPrompting daemon (see daemon.py).
+#
+# Imports nothing but the standard library, so asking a question costs a
+# socket round trip plus generation, not loading torch, the model and the
+# retrieval index. If no daemon is listening, one is started in the
+# background and stays up for later calls until it has been idle for a
+# while.
+#
+#   python client.py "sort a list of dicts by a key"
+#   python client.py < intents.txt
+#
+# The protocol is JSON lines over a Unix domain socket. A request is
+# {"intent", "top_k"} (or {"command": "shutdown"}); the daemon answers each
+# request with "docs", "with_docs" and "without_docs" events as they are
+# ready, then a "done" event, or an "error" event.
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_IDLE_TIMEOUT = 900
+
+
+def default_socket_path():
+    return os.environ.get('DOCPROMPT_SOCKET') or os.path.join(
+        tempfile.gettempdir(), f"docprompting-{os.getuid()}.sock")
+
+
+def _connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def start_daemon(socket_path, doc_path, idle_timeout):
+    """Starts daemon.py in the background, logging next to the socket; returns its Popen."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'daemon.py')
+    with open(socket_path + '.log', 'ab') as log:
+        return subprocess.Popen([sys.executable, script, '--socket', socket_path, '--docs', os.path.abspath(doc_path),
+                          '--idle-timeout', str(idle_timeout)],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def connect(socket_path, doc_path='data/docs.json', start=True, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+            start_timeout=600):
+    """
+    Connects to the daemon at socket_path, starting it first if start is set
+    and nothing listens there, and waiting up to start_timeout seconds for it
+    to load its models. Raises ConnectionError as soon as a daemon started
+    here fails; one that finds another daemon listening exits with status 0.
+    """
+    try:
+        return _connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not start:
+            raise
+    print(f"Starting the DocPrompting daemon (log: {socket_path}.log)...", file=sys.stderr)
+    daemon = start_daemon(socket_path, doc_path, idle_timeout)
+    deadline = time.monotonic() + start_timeout
+    while True:
+        time.sleep(0.2)
+        try:
+            return _connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if daemon.poll() not in (None, 0):
+                raise ConnectionError(f"the daemon exited with status {daemon.returncode} while starting; "
+                                      f"see {socket_path}.log")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"the daemon did not come up within {start_timeout}s; see {socket_path}.log")
+
+
+def ask(sock_file, intent, top_k=2):
+    """Sends one intent and yields the daemon's events up to and including "done" or "error"."""
+    sock_file.write((json.dumps({"intent": intent, "top_k": top_k}) + '\n').encode('utf-8'))
+    sock_file.flush()
+    for line in sock_file:
+        event = json.loads(line)
+        yield event
+        if event['event'] in ('done', 'error'):
+            return
+    raise ConnectionError('the daemon closed the connection')
+
+
+def print_event(event):
+    # The same output as the interactive mode of main.py.
+    if event['event'] == 'docs':
+        print("\nRetrieved Documentation Used:")
+        for i, doc in enumerate(event['docs']):
+            print(f"Doc {i+1}: {doc['content'].strip()}\n")
+    elif event['event'] == 'with_docs':
+        print(f"Code with DocPrompting:\n{event['code']}")
+    elif event['event'] == 'without_docs':
+        print(f"Code without DocPrompting:\n{event['code']}")
+    elif event['event'] == 'error':
+        print(f"Error: {event['message']}", file=sys.stderr)
+    sys.stdout.flush()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Ask the DocPrompting daemon to generate code')
+    parser.add_argument('intents', nargs='*', help='intents to answer; read one per line from stdin if none')
+    parser.add_argument('--socket', type=str, default=default_socket_path())
+    parser.add_argument('--docs', type=str, default='data/docs.json', help='corpus of a daemon started by this call')
+    parser.add_argument('--top-k', type=int, default=2)
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help='seconds a daemon started by this call waits for requests before exiting')
+    parser.add_argument('--no-start', action='store_true', help='fail instead of starting a daemon')
+    parser.add_argument('--json', action='store_true', help='print the raw event stream as JSON lines')
+    parser.add_argument('--shutdown', action='store_true', help='stop the daemon')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        sock = connect(args.socket, args.docs, start=not (args.no_start or args.shutdown),
+                       idle_timeout=args.idle_timeout)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit(f"No DocPrompting daemon listens on {args.socket}")
+    except (ConnectionError, TimeoutError) as e:
+        sys.exit(f"Could not start the DocPrompting daemon: {e}")
+    with sock, sock.makefile('rwb') as sock_file:
+        if args.shutdown:
+            sock_file.write(b'{"command": "shutdown"}\n')
+            sock_file.flush()
+            return
+        intents = args.intents or (line.strip() for line in sys.stdin)
+        for intent in intents:
+            if not intent:
+                continue
+            if not args.json:
+                print(f"Task: {intent}")
+            for event in ask(sock_file, intent, args.top_k):
+                if args.json:
+                    print(json.dumps(event), flush=True)
+                else:
+                    print_event(event)
+
+
+if __name__ == '__main__':
+    main()
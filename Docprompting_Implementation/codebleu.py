@@ -0,0 +1,315 @@
+# codebleu.py
+# CodeBLEU computed from sufficient statistics.
+#
+# Every component of CodeBLEU is a ratio of sums over examples: clipped ngram
+# counts for BLEU, weighted clipped counts for the keyword-weighted match and
+# match/total counts for syntax and dataflow match. corpus_stats() collects
+# those sums for a list of examples, merge_stats() adds two collections up and
+# scores_from_stats() turns them into the four component scores. Sharding the
+# corpus across processes therefore reduces to the same scores as one pass, and
+# per-example statistics give sentence-level scores and, summed, the corpus
+# scores of the same pass (see score_examples()). Statistics are computed from
+# per-snippet features (see features.py); features can be cached on disk
+# across runs, reference features are shared between hypothesis systems, and
+# several systems can be scored against the same references in one pass (see
+# systems_stats()).
+
+import csv
+import json
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import zip_longest
+
+import bleu
+import weighted_ngram_match
+import syntax_match
+import dataflow_match
+from features import ReferenceCache, example_stats, keyword_languages, load_keywords, make_weights
+
+
+def empty_stats():
+    return {
+        'ngram': (Counter(), Counter(), 0, 0),
+        'weighted_ngram': (Counter(), Counter(), 0, 0),
+        'syntax': (0, 0),
+        'dataflow': (0, 0),
+    }
+
+
+def corpus_stats(references, hypothesis, lang, keywords, reference_cache=None):
+    """
+    Sufficient statistics of all four CodeBLEU components.
+    :param references: list of reference lists, one list per hypothesis
+    :param hypothesis: list of hypothesis code strings
+    :param keywords: keyword list of lang, see load_keywords()
+    :param reference_cache: ReferenceCache to take reference and hypothesis features
+        from; a fresh in-memory one (deduplicating snippets of this call) by default
+    :return: dict with 'ngram', 'weighted_ngram', 'syntax' and 'dataflow' statistics
+    """
+    assert len(references) == len(hypothesis), (
+        "The number of hypotheses and their reference(s) should be the same"
+    )
+    return systems_stats(references, [hypothesis], lang, keywords, reference_cache)[0]
+
+
+def systems_stats(references, systems, lang, keywords, reference_cache=None):
+    """
+    corpus_stats() of several hypothesis systems against the same references.
+    Reference features are computed once per example and shared by all systems.
+    :param systems: list of hypothesis lists, one per system, each aligned with references
+    :return: list of statistics, one per system
+    """
+    for hypothesis in systems:
+        assert len(references) == len(hypothesis), (
+            "The number of hypotheses and their reference(s) should be the same"
+        )
+    if reference_cache is None:
+        reference_cache = ReferenceCache(lang, keywords)
+
+    # every unique snippet is cleaned, parsed and featurized once per call,
+    # with the ngrams of all references and of all hypotheses counted in a batch
+    flat_references = reference_cache.get_many([reference for sample in references for reference in sample])
+    candidates = list(dict.fromkeys(candidate for hypothesis in systems for candidate in hypothesis))
+    hypothesis_features = dict(zip(candidates, reference_cache.hypotheses.get_many(candidates)))
+
+    stats = [empty_stats() for _ in systems]
+    offset = 0
+    for i, references_sample in enumerate(references):
+        reference_features = flat_references[offset:offset + len(references_sample)]
+        offset += len(references_sample)
+        for k, hypothesis in enumerate(systems):
+            stats[k] = merge_stats(stats[k], example_stats(reference_features, hypothesis_features[hypothesis[i]]))
+    return stats
+
+
+def merge_stats(stats, other):
+    return {
+        'ngram': bleu.merge_bleu_stats(stats['ngram'], other['ngram']),
+        'weighted_ngram': weighted_ngram_match.merge_bleu_stats(stats['weighted_ngram'], other['weighted_ngram']),
+        'syntax': (stats['syntax'][0] + other['syntax'][0], stats['syntax'][1] + other['syntax'][1]),
+        'dataflow': (stats['dataflow'][0] + other['dataflow'][0], stats['dataflow'][1] + other['dataflow'][1]),
+    }
+
+
+def scores_from_stats(stats, warn=True):
+    """Returns (ngram, weighted ngram, syntax, dataflow) match scores."""
+    return (bleu.corpus_bleu_from_stats(stats['ngram']),
+            weighted_ngram_match.corpus_bleu_from_stats(stats['weighted_ngram']),
+            syntax_match.syntax_match_from_stats(stats['syntax']),
+            dataflow_match.dataflow_match_from_stats(stats['dataflow'], warn))
+
+
+def code_bleu(scores, params=(0.25, 0.25, 0.25, 0.25)):
+    alpha, beta, gamma, theta = params
+    ngram_match_score, weighted_ngram_match_score, syntax_match_score, dataflow_match_score = scores
+    return alpha*ngram_match_score\
+         + beta*weighted_ngram_match_score\
+         + gamma*syntax_match_score\
+         + theta*dataflow_match_score
+
+
+def _shards(examples, shard_size):
+    shard = []
+    for example in examples:
+        shard.append(example)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+_process_reference_caches = {}
+
+
+def _process_reference_cache(lang, keywords, cache_dir):
+    # One ReferenceCache per worker process, reused across the shards it scores.
+    key = (lang, tuple(keywords), cache_dir)
+    if key not in _process_reference_caches:
+        _process_reference_caches[key] = ReferenceCache(lang, keywords, cache_dir)
+    return _process_reference_caches[key]
+
+
+def _merge_systems_stats(stats, other):
+    return other if stats is None else [merge_stats(a, b) for a, b in zip(stats, other)]
+
+
+def _shard_stats(shard, lang, keywords, cache_dir=None, reference_cache=None):
+    if reference_cache is None:
+        reference_cache = _process_reference_cache(lang, keywords, cache_dir)
+    references = [example[1] for example in shard]
+    systems = [list(hypothesis) for hypothesis in zip(*(example[2] for example in shard))]
+    return systems_stats(references, systems, lang, keywords, reference_cache)
+
+
+def stream_systems_stats(examples, n_systems, lang, keywords, workers=1, shard_size=1000,
+                         reference_cache=None, cache_dir=None):
+    """
+    systems_stats() of a stream of (id, references, hypotheses) examples, where
+    hypotheses holds one hypothesis per system.
+    Examples are read shard by shard and, with workers > 1, scored by a pool
+    of worker processes with at most two shards per worker in flight, so
+    memory is bounded by the shard size rather than the corpus size. Each
+    worker parses its own shard; the reduction is exact.
+    :param reference_cache: ReferenceCache used when scoring in this process
+    :param cache_dir: on-disk feature cache directory, shared with worker processes
+    :return: list of statistics, one per system
+    """
+    stats = None
+    if workers <= 1:
+        if reference_cache is None:
+            reference_cache = ReferenceCache(lang, keywords, cache_dir)
+        for shard in _shards(examples, shard_size):
+            stats = _merge_systems_stats(stats, _shard_stats(shard, lang, keywords, reference_cache=reference_cache))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for shard in _shards(examples, shard_size):
+                pending.append(executor.submit(_shard_stats, shard, lang, keywords, cache_dir))
+                if len(pending) >= 2 * workers:
+                    stats = _merge_systems_stats(stats, pending.popleft().result())
+            while pending:
+                stats = _merge_systems_stats(stats, pending.popleft().result())
+    if stats is None:
+        stats = [empty_stats() for _ in range(n_systems)]
+    return stats
+
+
+def stream_stats(examples, lang, keywords, workers=1, shard_size=1000, reference_cache=None, cache_dir=None):
+    """stream_systems_stats() of a single system's (id, references, hypothesis) examples."""
+    examples = ((example_id, references, (hypothesis,)) for example_id, references, hypothesis in examples)
+    return stream_systems_stats(examples, 1, lang, keywords, workers, shard_size, reference_cache, cache_dir)[0]
+
+
+def corpus_code_bleu_stats(references, hypothesis, lang, keywords, workers=1, shard_size=None,
+                           reference_cache=None, cache_dir=None):
+    """stream_stats() of in-memory lists of references and hypotheses."""
+    assert len(references) == len(hypothesis)
+    if shard_size is None:
+        # A few shards per worker keeps the pool busy when shards differ in cost.
+        shard_size = max(1, -(-len(hypothesis) // (max(1, workers) * 4)))
+    examples = ((i, refs, hyp) for i, (refs, hyp) in enumerate(zip(references, hypothesis)))
+    return stream_stats(examples, lang, keywords, workers, shard_size, reference_cache, cache_dir)
+
+
+def _read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _references_of(record):
+    refs = record['refs']
+    return [refs] if isinstance(refs, str) else list(refs)
+
+
+def iter_jsonl_examples(path):
+    """
+    Lazily yields (id, references, hypothesis) from a JSONL file with one
+    {"id": ..., "refs": [...], "hyp": ...} record per example. Code keeps its
+    real newlines; records without an id are numbered by position.
+    """
+    for i, record in enumerate(_read_jsonl(path)):
+        yield record.get('id', i), _references_of(record), record['hyp']
+
+
+def iter_aligned_jsonl_examples(refs_path, hyp_path):
+    """
+    Lazily yields (id, references, hypothesis) from a references file of
+    {"id", "refs"} records and a hypotheses file of {"id", "hyp"} records.
+    Both files must list the ids in the same order; any mismatch is an error.
+    """
+    for example_id, references, hypotheses in iter_aligned_jsonl_systems(refs_path, [hyp_path]):
+        yield example_id, references, hypotheses[0]
+
+
+def iter_aligned_jsonl_systems(refs_path, hyp_paths):
+    """
+    Like iter_aligned_jsonl_examples() for several hypothesis files read in
+    lockstep; yields (id, references, hypotheses) with one hypothesis per file.
+    """
+    readers = [_read_jsonl(refs_path)] + [_read_jsonl(path) for path in hyp_paths]
+    for records in zip_longest(*readers):
+        ref_record = records[0]
+        for hyp_path, hyp_record in zip(hyp_paths, records[1:]):
+            if ref_record is None or hyp_record is None:
+                raise ValueError(f'{refs_path} and {hyp_path} have different numbers of records')
+            if ref_record['id'] != hyp_record['id']:
+                raise ValueError(f"id mismatch: reference {ref_record['id']!r} vs hypothesis {hyp_record['id']!r}"
+                                 f" in {hyp_path}")
+        yield ref_record['id'], _references_of(ref_record), tuple(record['hyp'] for record in records[1:])
+
+
+SENTENCE_FIELDS = ['id', 'ngram_match', 'weighted_ngram_match', 'syntax_match', 'dataflow_match', 'codebleu']
+
+
+def sentence_row(example_id, scores, params=(0.25, 0.25, 0.25, 0.25), system=None):
+    row = dict(zip(SENTENCE_FIELDS, (example_id,) + tuple(scores) + (code_bleu(scores, params),)))
+    if system is not None:
+        row['system'] = system
+    return row
+
+
+class SentenceWriter:
+    """
+    Streams per-example score rows as JSONL, or as CSV if path ends in .csv.
+    With with_system=True rows also carry the name of the system they score.
+    """
+
+    def __init__(self, path, with_system=False):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.csv_writer = None
+        if path.endswith('.csv'):
+            fieldnames = (['system'] if with_system else []) + SENTENCE_FIELDS
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+            self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def score_examples(examples, lang, keywords, params=(0.25, 0.25, 0.25, 0.25), on_example=None,
+                   reference_cache=None):
+    """
+    Scores a stream of examples in one pass with memory independent of its length.
+    :param examples: iterable of (id, references, hypothesis) tuples
+    :param on_example: called with sentence_row() of every example as it is scored
+    :param reference_cache: ReferenceCache to take reference features from
+    :return: corpus statistics, the sum of the per-example statistics
+    """
+    examples = ((example_id, references, (hypothesis,)) for example_id, references, hypothesis in examples)
+    return score_systems_examples(examples, [None], lang, keywords, params, on_example, reference_cache)[0]
+
+
+def score_systems_examples(examples, systems, lang, keywords, params=(0.25, 0.25, 0.25, 0.25), on_example=None,
+                           reference_cache=None):
+    """
+    score_examples() of several systems at once.
+    :param examples: iterable of (id, references, hypotheses) tuples, one hypothesis per system
+    :param systems: system names, put in the 'system' field of the sentence rows
+    :return: list of corpus statistics, one per system
+    """
+    if reference_cache is None:
+        reference_cache = ReferenceCache(lang, keywords)
+    stats = [empty_stats() for _ in systems]
+    for example_id, references, hypotheses in examples:
+        per_system = systems_stats([references], [[hypothesis] for hypothesis in hypotheses],
+                                       lang, keywords, reference_cache)
+        for k, system in enumerate(systems):
+            if on_example is not None:
+                on_example(sentence_row(example_id, scores_from_stats(per_system[k], warn=False), params, system))
+            stats[k] = merge_stats(stats[k], per_system[k])
+    return stats
@@ -0,0 +1,223 @@
+# daemon.py
+# Long-running DocPrompting server on a Unix domain socket.
+#
+# Loads the Retriever and the Generator once and answers the intents of any
+# number of concurrent clients (see client.py for the client and the
+# protocol). Connections are served by threads; retrieval runs concurrently,
+# while generation, which keeps the model busy anyway, is serialized. The
+# daemon exits after idle_timeout seconds without an open connection.
+#
+# One daemon owns a socket: it holds an exclusive lock on <socket>.lock and
+# listens before loading the models, so clients starting at the same time
+# queue on that daemon instead of each starting their own.
+#
+#   python daemon.py --idle-timeout 900
+import argparse
+import fcntl
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from client import DEFAULT_IDLE_TIMEOUT, default_socket_path
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, **event):
+        self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        self.server.connection_opened()
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                    if request.get('command') == 'shutdown':
+                        self.server.stop()
+                        return
+                    intent, top_k = str(request['intent']), int(request.get('top_k', 2))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    self.send(event='error', message=f"invalid request: {e}")
+                    continue
+                try:
+                    self.answer(intent, top_k)
+                except (BrokenPipeError, ConnectionResetError):
+                    raise
+                except Exception as e:
+                    # one failed intent does not take the daemon or the connection down
+                    self.send(event='error', message=f"{type(e).__name__}: {e}")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away
+        finally:
+            self.server.connection_closed()
+
+    def answer(self, intent, top_k):
+        server = self.server
+        start = time.perf_counter()
+        indices = server.retriever.retrieve_indices(intent, top_k)
+        docs = [server.retriever.store.content(i) for i in indices]
+        self.send(event='docs', docs=[{"id": server.retriever.store.doc_id(i), "content": content}
+                                      for i, content in zip(indices, docs)])
+        retrieved = time.perf_counter()
+        with server.generation_lock:
+            waited = time.perf_counter()
+            with_docs = server.generator.generate_batch([intent], [docs])[0]  # without printing the docs
+            self.send(event='with_docs', code=with_docs)
+            generated_with = time.perf_counter()
+            without_docs = server.generator.generate_batch([intent], [[]])[0]
+            self.send(event='without_docs', code=without_docs)
+            generated_without = time.perf_counter()
+        self.send(event='done', timings={
+            "retrieval": retrieved - start,
+            "queued": waited - retrieved,
+            "generation_with_docs": generated_with - waited,
+            "generation_without_docs": generated_without - generated_with,
+        })
+
+
+class DocPromptServer(socketserver.ThreadingUnixStreamServer):
+    """Serves a Retriever and a Generator on socket_path until idle for idle_timeout seconds."""
+
+    daemon_threads = True
+    request_queue_size = 64  # clients wait in the backlog while the models load
+
+    def __init__(self, socket_path, retriever, generator, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        os.chmod(socket_path, 0o600)  # the daemon answers its user only
+        self.socket_path = socket_path
+        self.retriever = retriever
+        self.generator = generator
+        self.idle_timeout = idle_timeout
+        self.generation_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.connections = 0
+        self.last_activity = time.monotonic()
+        self.stopping = threading.Event()
+
+    def connection_opened(self):
+        with self.state_lock:
+            self.connections += 1
+
+    def connection_closed(self):
+        with self.state_lock:
+            self.connections -= 1
+            self.last_activity = time.monotonic()
+
+    def idle_for(self):
+        with self.state_lock:
+            return 0.0 if self.connections else time.monotonic() - self.last_activity
+
+    def stop(self):
+        # shutdown() waits for serve_forever(), so it runs on its own thread.
+        if not self.stopping.is_set():
+            self.stopping.set()
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def watch_idle(self):
+        while not self.stopping.wait(min(self.idle_timeout, 5.0)):
+            if self.idle_for() >= self.idle_timeout:
+                print(f"Idle for {self.idle_timeout:g}s, shutting down", flush=True)
+                self.stop()
+
+    def serve(self):
+        self.last_activity = time.monotonic()  # not counting the time the models took to load
+        threading.Thread(target=self.watch_idle, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.stopping.set()
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def _listening(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def _remove_stale_socket(socket_path):
+    # A socket file nobody listens on is left over from a daemon that died.
+    # Only the holder of the lock (see lock_socket()) may remove it, so a
+    # socket another daemon has bound but not yet listens on is never taken.
+    if not os.path.exists(socket_path):
+        return
+    if _listening(socket_path):
+        raise OSError(f"a daemon already listens on {socket_path}")
+    os.remove(socket_path)
+
+
+def lock_socket(socket_path):
+    """
+    Takes the exclusive lock that makes this process the daemon of
+    socket_path, waiting while another daemon holds it without listening
+    (it is starting or shutting down).
+    :return: the locked file, to be kept open while serving; None if another
+        daemon listens on socket_path
+    """
+    lock_file = open(socket_path + '.lock', 'w')
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock_file
+        except BlockingIOError:
+            pass
+        if _listening(socket_path):
+            lock_file.close()
+            return None
+        time.sleep(0.1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve DocPrompting on a Unix domain socket')
+    parser.add_argument('--socket', type=str, default=default_socket_path())
+    parser.add_argument('--docs', type=str, default='data/docs.json')
+    parser.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help='seconds without an open connection after which the daemon exits')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    lock_file = lock_socket(args.socket)
+    if lock_file is None:
+        print(f"A daemon already listens on {args.socket}", flush=True)
+        return
+    with lock_file:
+        try:
+            server = DocPromptServer(args.socket, None, None, args.idle_timeout)
+        except OSError as e:
+            sys.exit(str(e))
+        print(f"Listening on {args.socket}, loading the models", flush=True)
+        # the heavy imports happen here, once per daemon; requests wait until
+        # the models are loaded
+        try:
+            from retriever import Retriever
+            from generator import Generator
+
+            server.retriever = Retriever(args.docs)
+            server.generator = Generator()
+        except BaseException:
+            server.server_close()
+            os.remove(args.socket)
+            raise
+        print("Models loaded", flush=True)
+        server.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,40 +1,22 @@
 # Copyright (c) Microsoft Corporation. 
 # Licensed under the MIT license.
 
-from tree_sitter import Language, Parser
-from tree_sitter_languages import get_language # MODIFICATION: Import get_language
-
-# Assuming DFG functions are correctly defined in a 'parser' directory/module
-# Adjust these imports based on your actual project structure.
-# If 'parser' is a directory with DFG.py and utils.py:
-try:
-    from parser.DFG import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
-    from parser.utils import (remove_comments_and_docstrings,
-                              tree_to_token_index,
-                              index_to_code_token,
-                              tree_to_variable_index)
-except ImportError:
-    # Fallback if parser is a .py file or structure is different
-    # This might require you to ensure parser.py is in PYTHONPATH or similar
-    # For example, if they are in a sibling 'parser.py' file:
-    # from parser_module import DFG_python, ... (if parser.py is named parser_module.py)
-    # Or if they are directly in a parser.py in the same dir (less common for modules):
-    try:
-        from parser.DFG import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
-        from utils import (remove_comments_and_docstrings, # Assuming utils.py for these
-                           tree_to_token_index,
-                           index_to_code_token,
-                           tree_to_variable_index)
-    except ImportError as e:
-        print(f"Could not import DFG functions or utils from parser. Error: {e}")
-        print("Please ensure your 'parser' module/directory structure and imports are correct.")
-        # Define them as None or raise error to indicate a critical missing component
-        DFG_python = DFG_java = DFG_ruby = DFG_go = DFG_php = DFG_javascript = DFG_csharp = None
-        remove_comments_and_docstrings = tree_to_token_index = index_to_code_token = tree_to_variable_index = None
+from collections import Counter
+
+from parser_pool import get_parser, language_name
+
+from parser import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
+from parser import python_data_flow
+from parser import (remove_comments_and_docstrings,
+                    tree_to_token_index,
+                    index_to_code_token,
+                    tree_to_variable_index)
 
 
 import pdb # pdb import was in the original, keeping it.
 
+from preprocess import code_hash, map_snippets, parse_corpus
+
 dfg_function={
     'python':DFG_python,
     'java':DFG_java,
@@ -45,6 +27,12 @@ dfg_function={
     'c_sharp':DFG_csharp,
 }
 
+# The extractors get_data_flow() can run fused with token indexing and merging,
+# reading tokens from the code by byte offset.
+fused_data_flow_function={
+    DFG_python:python_data_flow,
+}
+
 def calc_dataflow_match(references, candidate, lang):
     # Ensure references is a list of lists for corpus_dataflow_match
     if isinstance(references, str):
@@ -54,108 +42,119 @@ def calc_dataflow_match(references, candidate, lang):
     return corpus_dataflow_match(references, [candidate], lang)
 
 
-def corpus_dataflow_match(references, candidates, lang):   
-    # MODIFICATION: Initialize parser and set language using tree-sitter-languages
-    ts_parser = Parser() # Renamed to ts_parser to avoid conflict with the list 'parser' below
+def corpus_dataflow_match(references, candidates, lang, parsed=None):
+    match_count, total_count = corpus_dataflow_match_stats(references, candidates, lang, parsed)
+    return dataflow_match_from_stats((match_count, total_count))
+
+def dataflow_match_from_stats(stats, warn=True):
+    # warn=False silences the empty-corpus warning, e.g. for per-example scores
+    match_count, total_count = stats
+    if total_count == 0:
+        if warn:
+            print("WARNING: There is no reference data-flows extracted from the whole corpus, and the data-flow match score degenerates to 0. Please consider ignoring this score.")
+        return 0.0 # Return 0.0 not 0 to be consistent with float scores
+        
+    score = match_count / total_count
+    return score
+
+def corpus_dataflow_match_stats(references, candidates, lang, parsed=None):
+    # Returns (match_count, total_count). Counts of disjoint parts of a corpus
+    # add up to the counts of the whole corpus.
+    # Parsers are pooled per language and thread (see parser_pool.py)
     try:
-        language_to_load = lang
-        # Add mappings if lang argument differs from tree-sitter-languages naming
-        if lang == 'c_sharp': 
-            language_to_load = 'c_sharp'
-        elif lang == 'javascript': # Example, if you use 'js' as lang arg
-            language_to_load = 'javascript'
-        # ... other potential mappings ...
-            
-        selected_language = get_language(language_to_load)
-        ts_parser.set_language(selected_language)
+        ts_parser = get_parser(lang)
     except Exception as e:
         print(f"Error setting language '{lang}' in dataflow_match.py using tree-sitter-languages: {e}")
         print(f"  Please ensure 'tree-sitter' and 'tree-sitter-languages' are installed.")
         print(f"  Supported languages include 'python', 'java', 'javascript', 'c_sharp', 'ruby', 'go', 'php'.")
         print(f"  Ensure your --lang argument (currently '{lang}') matches one of these.")
-        return 0.0 # Return default score on critical error
+        return 0, 0 # No counts, i.e. the default score on critical error
 
     # The 'parser' variable in the original script was a list containing the
     # tree-sitter parser object and the language-specific DFG extraction function.
     # We will now use our configured ts_parser.
     # Also check if the DFG function for the lang is available.
-    if lang not in dfg_function or dfg_function[lang] is None:
+    dfg_lang = language_name(lang) # e.g. 'js' -> 'javascript'
+    if dfg_lang not in dfg_function or dfg_function[dfg_lang] is None:
         print(f"Warning: DFG function for language '{lang}' is not available. Dataflow match will be 0.")
-        return 0.0
+        return 0, 0
         
-    parser_and_dfg_func = [ts_parser, dfg_function[lang]] 
+    dfg_func = dfg_function[dfg_lang]
     
     match_count = 0
     total_count = 0
 
+    def snippet_counts(cleaned, tree):
+        return dataflow_counts(normalize_dataflow(get_data_flow(cleaned, [ts_parser, dfg_func], tree)))
+
+    # Comment/docstring removal, parsing and data flow extraction happen once
+    # per unique snippet; get_data_flow reuses the shared trees.
+    if parsed is None:
+        parsed = parse_corpus(references, candidates, lang, ts_parser)
+    counts = map_snippets(references, candidates, lambda code: snippet_counts(*parsed.get(code)))
+
     for i in range(len(candidates)):
         references_sample = references[i] # list of reference strings for this candidate
-        candidate = candidates[i] 
+        candidate_counts = counts[code_hash(candidates[i])]
         
         for reference in references_sample:
-            # MODIFICATION: Use the 'lang' parameter for remove_comments_and_docstrings
-            # The original code hardcoded 'java', which was an error.
-            candidate_cleaned = candidate
-            reference_cleaned = reference
-            if remove_comments_and_docstrings: # Check if function is available
-                try:
-                    candidate_cleaned = remove_comments_and_docstrings(candidate, lang)
-                except: # Broad except from original
-                    pass    
-                try:
-                    reference_cleaned = remove_comments_and_docstrings(reference, lang)
-                except: # Broad except from original
-                    pass  
-
-            # Pass the parser_and_dfg_func list to get_data_flow
-            cand_dfg = get_data_flow(candidate_cleaned, parser_and_dfg_func)
-            ref_dfg = get_data_flow(reference_cleaned, parser_and_dfg_func)
-            
-            normalized_cand_dfg = normalize_dataflow(cand_dfg)
-            normalized_ref_dfg = normalize_dataflow(ref_dfg)
-
-            if len(normalized_ref_dfg) > 0:
-                total_count += len(normalized_ref_dfg)
-                # Create a copy of normalized_cand_dfg for modification if elements are removed
-                # This ensures that if a candidate dataflow matches multiple reference dataflows (if allowed),
-                # it's only counted once per unique candidate dataflow.
-                # The original .remove() modifies the list being iterated over indirectly.
-                # A safer way is to count available candidate dataflows.
-                
-                # Using a simpler matching: count how many ref dataflows are in cand_dataflows
-                # For more precise "BLEU-like" dataflow matching, one might use collections.Counter
-                # or ensure one-to-one matching if duplicates in ref_dfg shouldn't match same item in cand_dfg.
-                # The original remove implies trying to match each ref_dfg item at most once.
-                
-                # Let's replicate the original logic with a mutable copy for cand_dfg
-                temp_normalized_cand_dfg = list(normalized_cand_dfg) # Make a mutable copy
-
-                for dataflow in normalized_ref_dfg:
-                    if dataflow in temp_normalized_cand_dfg:
-                            match_count += 1
-                            temp_normalized_cand_dfg.remove(dataflow) # Remove from copy to ensure one-to-one match
+            pair_match_count, pair_total_count = count_dataflow_key_matches(
+                counts[code_hash(reference)], candidate_counts)
+            match_count += pair_match_count
+            total_count += pair_total_count
     
-    if total_count == 0:
-        print("WARNING: There is no reference data-flows extracted from the whole corpus, and the data-flow match score degenerates to 0. Please consider ignoring this score.")
-        return 0.0 # Return 0.0 not 0 to be consistent with float scores
-        
-    score = match_count / total_count
-    return score
+    return match_count, total_count
+
+def snippet_dataflow(code, lang, tree=None):
+    # The normalized data flow of one (already cleaned) snippet, i.e. its
+    # dataflow features; [] when lang has no DFG function.
+    dfg_func = dfg_function.get(language_name(lang))
+    if dfg_func is None:
+        return []
+    return normalize_dataflow(get_data_flow(code, [get_parser(lang), dfg_func], tree))
+
+def dataflow_counts(normalized_dfg):
+    # The normalized dataflow items of a snippet as a multiset of hashable
+    # keys: (var, relationship, tuple of parent vars), with parents in order.
+    return Counter((var_name, relationship, tuple(par_vars_name_list))
+                   for var_name, relationship, par_vars_name_list in normalized_dfg)
+
+def count_dataflow_key_matches(ref_counts, cand_counts):
+    # count_dataflow_matches() of dataflow_counts() multisets. Each candidate
+    # dataflow can match at most one reference dataflow, so a key matches as
+    # many times as it occurs in both.
+    match_count = 0
+    for key, count in ref_counts.items():
+        cand_count = cand_counts.get(key)
+        if cand_count:
+            match_count += min(count, cand_count)
+    return match_count, sum(ref_counts.values())
+
+def count_dataflow_matches(normalized_ref_dfg, normalized_cand_dfg):
+    # Returns (match_count, total_count) for one reference/candidate pair.
+    return count_dataflow_key_matches(dataflow_counts(normalized_ref_dfg), dataflow_counts(normalized_cand_dfg))
 
-def get_data_flow(code, parser_info): # parser_info is the list [ts_parser_object, dfg_extraction_func]
+def get_data_flow(code, parser_info, tree=None): # parser_info is the list [ts_parser_object, dfg_extraction_func]
     # Unpack the parser object and DFG function
     ts_parser = parser_info[0]
     dfg_extraction_func = parser_info[1]
 
+    fused_func = fused_data_flow_function.get(dfg_extraction_func)
+    if fused_func is not None:
+        # Token indexing, extraction and merging in one pass over the tree.
+        try:
+            data = bytes(code, 'utf8')
+            if tree is None:
+                tree = ts_parser.parse(data)
+            return fused_func(tree.root_node, data)
+        except Exception:
+            return []
+
     try:
-        tree = ts_parser.parse(bytes(code,'utf8'))    
+        if tree is None: # Parse here unless a shared tree from parse_corpus was given
+            tree = ts_parser.parse(bytes(code,'utf8'))    
         root_node = tree.root_node  
         
-        # Check if tree_to_token_index and index_to_code_token are available
-        if not tree_to_token_index or not index_to_code_token:
-            print("Warning: tree_to_token_index or index_to_code_token not available. Cannot extract detailed DFG.")
-            return []
-
         tokens_index=tree_to_token_index(root_node)     
         code_lines=code.split('\n') # Renamed from 'code' to 'code_lines' to avoid conflict
         code_tokens=[index_to_code_token(x,code_lines) for x in tokens_index]  
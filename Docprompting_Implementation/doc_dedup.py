@@ -0,0 +1,139 @@
+# doc_dedup.py
+# Near-duplicate removal for the documentation corpus.
+#
+# Many corpus entries share (nearly) the same docstring: exception classes,
+# methods of related types, functions re-exported under several modules.
+# They bloat the TF-IDF matrix and waste prompt space when several of them
+# are retrieved together. Each entry's docstring is reduced to a set of word
+# shingles and a MinHash signature; LSH banding finds candidate pairs, which
+# are kept when their signatures agree on at least the threshold fraction of
+# hashes (an estimate of their Jaccard similarity). Clusters of such pairs
+# are replaced by their first entry, which lists the ids of the others as
+# aliases.
+
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+# The default token pattern of sklearn's TfidfVectorizer, used by Retriever.
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+_PRIME = (1 << 31) - 1
+
+
+def shingles(text, size=3):
+    """The set of lowercased word size-grams of text, or of its words if it has fewer."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return set(words)
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=0):
+    """
+    MinHash signatures of shingle sets, from num_perm random hash functions
+    (a * x + b) mod (2^31 - 1) over the CRC-32 of every shingle.
+    :return: int64 array of shape (len(shingle_sets), num_perm); rows of empty
+        sets are all 2^31 - 1
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, _PRIME, size=num_perm, dtype=np.int64)
+    b = rng.randint(0, _PRIME, size=num_perm, dtype=np.int64)
+    signatures = np.full((len(shingle_sets), num_perm), _PRIME, dtype=np.int64)
+    for i, shingle_set in enumerate(shingle_sets):
+        if shingle_set:
+            x = np.fromiter((zlib.crc32(s.encode('utf-8')) % _PRIME for s in shingle_set),
+                            dtype=np.int64, count=len(shingle_set))
+            signatures[i] = ((np.outer(x, a) + b) % _PRIME).min(axis=0)
+    return signatures
+
+
+def near_duplicate_clusters(signatures, threshold=0.85, bands=16, candidates=None):
+    """
+    Groups rows whose signatures agree on at least threshold of their hashes.
+    Rows sharing all hashes of any of the bands are compared; groups are
+    closed under the pairs that pass.
+    :param candidates: indexes of the rows to consider (default: all)
+    :return: list of clusters of two or more row indexes, each sorted
+    """
+    n_rows, num_perm = signatures.shape
+    rows_per_band = num_perm // bands
+    if candidates is None:
+        candidates = range(n_rows)
+    parent = {}
+
+    def find(i):
+        root = i
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while i != root:
+            parent[i], i = root, parent.get(i, i)
+        return root
+
+    for band in range(bands):
+        columns = slice(band * rows_per_band, (band + 1) * rows_per_band)
+        buckets = defaultdict(list)
+        for i in candidates:
+            buckets[signatures[i, columns].tobytes()].append(i)
+        for bucket in buckets.values():
+            for k, i in enumerate(bucket):
+                for j in bucket[:k]:
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j and np.mean(signatures[i] == signatures[j]) >= threshold:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = defaultdict(list)
+    for i in parent:
+        clusters[find(i)].append(i)
+    return [sorted(cluster) for cluster in clusters.values() if len(cluster) > 1]
+
+
+def index_size(docs):
+    """
+    (entries, characters, vocabulary, TF-IDF nonzeros) of a corpus, as the
+    Retriever's default TfidfVectorizer would index its contents.
+    """
+    vocabulary = set()
+    nonzeros = 0
+    for doc in docs:
+        terms = set(TOKEN_PATTERN.findall(doc['content'].lower()))
+        vocabulary.update(terms)
+        nonzeros += len(terms)
+    return len(docs), sum(len(doc['content']) for doc in docs), len(vocabulary), nonzeros
+
+
+def _body(content):
+    # The docstring of an entry, without its "name(signature):" line.
+    return content.split('\n', 1)[1] if '\n' in content else content
+
+
+def deduplicate(docs, threshold=0.85, num_perm=128, bands=16):
+    """
+    Replaces every cluster of near-duplicate docs by its first doc, whose
+    "aliases" list the ids of the others (and their own aliases).
+    :param docs: corpus entries with "id" and "content"
+    :param threshold: estimated Jaccard similarity of docstring shingles above
+        which two entries are duplicates
+    :return: (deduplicated docs in corpus order, {"before": index_size(docs),
+        "after": index_size(deduplicated), "clusters": number of clusters})
+    """
+    shingle_sets = [shingles(_body(doc['content'])) for doc in docs]
+    signatures = minhash_signatures(shingle_sets, num_perm)
+    candidates = [i for i, shingle_set in enumerate(shingle_sets) if shingle_set]
+    clusters = near_duplicate_clusters(signatures, threshold, bands, candidates)
+
+    dropped = set()
+    canonical = {}
+    for cluster in clusters:
+        first = cluster[0]
+        aliases = list(docs[first].get('aliases', []))
+        for i in cluster[1:]:
+            aliases.append(docs[i]['id'])
+            aliases.extend(docs[i].get('aliases', []))
+            dropped.add(i)
+        canonical[first] = dict(docs[first], aliases=aliases)
+    deduplicated = [canonical.get(i, doc) for i, doc in enumerate(docs) if i not in dropped]
+    report = {"before": index_size(docs), "after": index_size(deduplicated), "clusters": len(clusters)}
+    return deduplicated, report
@@ -0,0 +1,188 @@
+# doc_store.py
+# Offset-indexed, memory-mapped store of the documentation corpus.
+#
+# The retriever only ever needs the contents of the few documents it returns,
+# so contents are not kept as Python strings. A store is a directory holding
+# all contents as one contiguous UTF-8 blob and an offsets array, plus the
+# same for document ids (and alias ids, see doc_dedup.py) with a sorted
+# permutation to look ids up by binary search. Blobs are memory-mapped and
+# arrays are numpy .npy files opened with mmap_mode='r', so opening a store
+# reads nothing but its metadata and resident memory does not grow with the
+# corpus; a content is decoded only when it is asked for.
+
+import json
+import mmap
+import os
+import tempfile
+from array import array
+
+import numpy as np
+
+STORE_VERSION = 1
+
+_META = 'meta.json'
+
+
+def _write_file(directory, name, write):
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        write(f)
+    os.replace(temp_path, os.path.join(directory, name))
+
+
+def _write_blob(directory, name, strings):
+    # Writes the UTF-8 strings back to back; returns their offsets (n + 1).
+    offsets = array('q', [0])
+
+    def write(f):
+        for s in strings:
+            data = s.encode('utf-8')
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    _write_file(directory, name + '.bin', write)
+    _write_file(directory, name + '.offsets.npy', lambda f: np.save(f, np.frombuffer(offsets, dtype=np.int64)))
+    return offsets
+
+
+def build_doc_store(docs, directory, source=None):
+    """
+    Writes corpus entries to a store in directory, replacing any store there.
+    :param docs: iterable of {"id", "content"} entries, optionally with
+        "aliases" (ids that are looked up as the entry); read once
+    :param source: stat of the JSON file docs were read from, recorded so
+        open_doc_store() can tell when the store is stale
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, _META)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)  # the store is incomplete until meta.json is back
+
+    ids, id_docs = [], []
+    aliases = []
+
+    def contents():
+        for i, doc in enumerate(docs):
+            ids.append(doc['id'])
+            id_docs.append(i)
+            for alias in doc.get('aliases', []):
+                aliases.append((alias, i))
+            yield doc['content']
+
+    content_offsets = _write_blob(directory, 'content', contents())
+    n_docs = len(content_offsets) - 1
+    for alias, i in aliases:
+        ids.append(alias)
+        id_docs.append(i)
+    # rows sorted by id bytes, the order index_of() searches in
+    id_bytes = [doc_id.encode('utf-8') for doc_id in ids]
+    order = sorted(range(len(ids)), key=id_bytes.__getitem__)
+    _write_blob(directory, 'ids', ids)
+    _write_file(directory, 'ids.docs.npy', lambda f: np.save(f, np.asarray(id_docs, dtype=np.int64)))
+    _write_file(directory, 'ids.sorted.npy', lambda f: np.save(f, np.asarray(order, dtype=np.int64)))
+
+    meta = {"version": STORE_VERSION, "documents": n_docs, "ids": len(ids)}
+    if source is not None:
+        meta["source"] = {"size": source.st_size, "mtime_ns": source.st_mtime_ns}
+    _write_file(directory, _META, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''  # an empty file cannot be mapped
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class DocStore:
+    """
+    A store written by build_doc_store(). Documents are numbered in corpus
+    order; content() decodes one on demand from the mapped blob.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, _META), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"{directory} holds a document store of another version")
+        self.directory = directory
+        self._content = _map(os.path.join(directory, 'content.bin'))
+        self._content_offsets = np.load(os.path.join(directory, 'content.offsets.npy'), mmap_mode='r')
+        self._ids = _map(os.path.join(directory, 'ids.bin'))
+        self._id_offsets = np.load(os.path.join(directory, 'ids.offsets.npy'), mmap_mode='r')
+        self._id_docs = np.load(os.path.join(directory, 'ids.docs.npy'), mmap_mode='r')
+        self._id_order = np.load(os.path.join(directory, 'ids.sorted.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['documents']
+
+    def content(self, i):
+        """The content of document i."""
+        start, end = self._content_offsets[i], self._content_offsets[i + 1]
+        return str(memoryview(self._content)[start:end], 'utf-8')
+
+    def contents(self):
+        """Every content in corpus order, decoded one at a time."""
+        for i in range(len(self)):
+            yield self.content(i)
+
+    def doc_id(self, i):
+        """The id of document i."""
+        return self._id(i).decode('utf-8')
+
+    def _id(self, row):
+        return bytes(memoryview(self._ids)[self._id_offsets[row]:self._id_offsets[row + 1]])
+
+    def index_of(self, doc_id):
+        """The number of the document with doc_id as its id or one of its aliases."""
+        key = doc_id.encode('utf-8')
+        order = self._id_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self._id(order[lo]) == key:
+            return int(self._id_docs[order[lo]])
+        raise KeyError(doc_id)
+
+    def get(self, doc_id):
+        """The content of the document with doc_id as its id or one of its aliases."""
+        return self.content(self.index_of(doc_id))
+
+    def close(self):
+        for blob in (self._content, self._ids):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+
+
+def store_path(doc_path):
+    """The store directory kept next to a JSON corpus, e.g. data/docs.store for data/docs.json."""
+    return os.path.splitext(doc_path)[0] + '.store'
+
+
+def open_doc_store(doc_path):
+    """
+    Opens the store of a corpus. doc_path is a store directory, or a JSON
+    corpus (see generate_docs.py) whose store is (re)built next to it when
+    missing or older than the JSON file.
+    :rtype: DocStore
+    """
+    if os.path.isdir(doc_path):
+        return DocStore(doc_path)
+    directory = store_path(doc_path)
+    source = os.stat(doc_path)
+    try:
+        store = DocStore(directory)
+        recorded = store.meta.get('source', {})
+        if recorded.get('size') == source.st_size and recorded.get('mtime_ns') == source.st_mtime_ns:
+            return store
+        store.close()
+    except (OSError, ValueError):
+        pass
+    with open(doc_path, 'r', encoding='utf-8') as f:
+        docs = json.load(f)
+    build_doc_store(docs, directory, source)
+    del docs
+    return DocStore(directory)
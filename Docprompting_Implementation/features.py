@@ -0,0 +1,308 @@
+# features.py
+# Per-snippet CodeBLEU features and a persistent feature cache.
+#
+# Scoring an example needs, for every reference and the hypothesis, the
+# tokens, ngram counts, subtree hashes and normalized data flow of the code
+# (plus keyword weights for references). snippet_features() extracts them once
+# per snippet and example_stats() matches them into the statistics used by
+# codebleu. FeatureCache keeps features in memory and optionally in a SQLite
+# FeatureStore on disk, keyed by content hash, language and extractor version,
+# so snippets seen in an earlier run or by another hypothesis system are not
+# parsed again. ReferenceCache caches both sides of a corpus.
+#
+# Ngram counts are keyed by the process-local token ids of ngram_ids and
+# extracted for whole batches of snippets at once; the on-disk store keeps only
+# the tokens and recounts the ngrams when features are loaded.
+
+import os
+import pickle
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, namedtuple
+from fractions import Fraction
+from functools import lru_cache
+
+import bleu
+import weighted_ngram_match
+import syntax_match
+import dataflow_match
+import preprocess
+import ngram_ids
+import ngram_match
+from parser_pool import get_parser
+
+# Bump whenever snippet_features() changes, so stale on-disk features are ignored.
+FEATURES_VERSION = 7
+
+SnippetFeatures = namedtuple('SnippetFeatures', ['tokens', 'ngram_counts', 'weights', 'sub_trees', 'dataflow'])
+
+# One keyword file per language, shipped next to this module.
+KEYWORDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'keywords')
+
+
+def keyword_languages():
+    """The languages with a keyword list in KEYWORDS_DIR, which are the ones that can be scored."""
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(KEYWORDS_DIR) if name.endswith('.txt'))
+
+
+@lru_cache(maxsize=None)
+def load_keywords(lang):
+    path = os.path.join(KEYWORDS_DIR, lang + '.txt')
+    if not os.path.exists(path):
+        raise ValueError(f'No keyword list for language {lang!r} in {KEYWORDS_DIR}')
+    with open(path, 'r', encoding='utf-8') as f:
+        return tuple(x.strip() for x in f if x.strip())
+
+
+def make_weights(reference_tokens, key_word_list):
+    key_word_set = frozenset(key_word_list)
+    return {token:1 if token in key_word_set else 0.2 \
+            for token in reference_tokens}
+
+
+class KeywordWeights:
+    """
+    make_weights() of one keyword list compiled for the token ids of
+    ngram_ids: table[id] is the weight of that token. The table is shared by
+    all references and extended as the vocabulary grows.
+    """
+
+    def __init__(self, keywords, vocab=None):
+        self.keywords = frozenset(keywords)
+        self.vocab = vocab if vocab is not None else ngram_ids.default_vocab()
+        self.table = []
+
+    def update(self):
+        """Returns the table, with a weight for every token interned so far."""
+        keywords = self.keywords
+        self.table.extend(1 if token in keywords else 0.2 for token in self.vocab.tokens[len(self.table):])
+        return self.table
+
+
+@lru_cache(maxsize=None)
+def keyword_weights(keywords):
+    """The KeywordWeights of a keyword tuple, compiled once per process."""
+    return KeywordWeights(keywords)
+
+
+def _ngram_features(token_lists, keywords, max_n):
+    # (ngram counts, weights) of many snippets, counted in one batch
+    counts = ngram_ids.batch_ngram_counts(token_lists, max_n)
+    weights = keyword_weights(tuple(keywords)).update() if keywords is not None else None
+    return [(snippet_counts, weights) for snippet_counts in counts]
+
+
+def _tree_features(code, lang):
+    try:
+        cleaned, tree = preprocess.clean_and_parse(code, lang, get_parser(lang))
+    except Exception:
+        cleaned, tree = code, None # unknown language: no syntax/dataflow features
+    sub_trees = syntax_match.sub_tree_hashes(tree.root_node) if tree is not None else None
+    dataflow = dataflow_match.dataflow_counts(
+        dataflow_match.snippet_dataflow(cleaned, lang, tree) if tree is not None else [])
+    return sub_trees, dataflow
+
+
+def snippets_features(codes, lang, keywords=None, max_n=4):
+    """
+    Extracts the features of many code snippets.
+    :param keywords: keyword list for reference weights; None for hypotheses
+    :return: list of SnippetFeatures; sub_trees is None when the code could not be parsed
+    """
+    token_lists = [code.split() for code in codes]
+    return [SnippetFeatures(tokens, counts, weights, *_tree_features(code, lang))
+            for code, tokens, (counts, weights)
+            in zip(codes, token_lists, _ngram_features(token_lists, keywords, max_n))]
+
+
+def snippet_features(code, lang, keywords=None, max_n=4):
+    """snippets_features() of a single snippet."""
+    return snippets_features([code], lang, keywords, max_n)[0]
+
+
+def example_stats(reference_features, hypothesis_features, max_n=4):
+    """
+    CodeBLEU statistics of one example, in the format of codebleu.corpus_stats().
+    :param reference_features: list of SnippetFeatures of the references (with weights)
+    :param hypothesis_features: SnippetFeatures of the hypothesis
+    """
+    hyp = hypothesis_features
+    # both ngram metrics in one pass over the reference ngrams
+    match = ngram_match.match_counts([ref.ngram_counts[:max_n] for ref in reference_features],
+                                     hyp.ngram_counts[:max_n], [ref.weights for ref in reference_features])
+    ngram_numerators, ngram_denominators = Counter(), Counter()
+    weighted_numerators, weighted_denominators = Counter(), Counter()
+    for n in range(1, max_n + 1):
+        ngram_numerators[n] += match.p_numerators[n - 1]
+        ngram_denominators[n] += match.p_denominators[n - 1]
+        weighted_numerators[n] += Fraction(match.r_numerators[n - 1])
+        weighted_denominators[n] += Fraction(match.r_denominators[n - 1])
+
+    hyp_len = len(hyp.tokens)
+    ref_len = bleu.closest_ref_length([ref.tokens for ref in reference_features], hyp_len)
+    # weighted_ngram_match measures the [tokens, weights] pairs it is given,
+    # not the token lists; kept as is so scores do not change.
+    weighted_ref_len = weighted_ngram_match.closest_ref_length(
+        [[ref.tokens, ref.weights] for ref in reference_features], hyp_len)
+
+    syntax_matches, syntax_total = 0, 0
+    dataflow_matches, dataflow_total = 0, 0
+    for ref in reference_features:
+        if ref.sub_trees is not None and hyp.sub_trees is not None:
+            match_count, total_count = syntax_match.count_sub_tree_hash_matches(ref.sub_trees, hyp.sub_trees)
+            syntax_matches += match_count
+            syntax_total += total_count
+        match_count, total_count = dataflow_match.count_dataflow_key_matches(ref.dataflow, hyp.dataflow)
+        dataflow_matches += match_count
+        dataflow_total += total_count
+
+    return {
+        'ngram': (ngram_numerators, ngram_denominators, hyp_len, ref_len),
+        'weighted_ngram': (weighted_numerators, weighted_denominators, hyp_len, weighted_ref_len),
+        'syntax': (syntax_matches, syntax_total),
+        'dataflow': (dataflow_matches, dataflow_total),
+    }
+
+
+# Keys per SELECT, within SQLite's default limit on query parameters.
+_SQL_BATCH = 500
+
+# The FeatureStore file in a feature cache directory.
+FEATURE_STORE_FILE = 'features.sqlite3'
+
+
+class FeatureStore:
+    """
+    SQLite file of snippet features keyed by (code hash, language, extractor
+    version): the tokens, subtree hashes and normalized data flow of a
+    snippet. These do not depend on the side a snippet is scored on, so
+    references and hypotheses share rows. Each process opens its own
+    connection; SQLite's locking lets worker processes share the file.
+    """
+
+    def __init__(self, path, version=FEATURES_VERSION):
+        self.path = path
+        self.version = version
+        self.lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        # A connection inherited from the parent of a forked worker is not used.
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS features ('
+                                   'code_hash TEXT NOT NULL, lang TEXT NOT NULL, version INTEGER NOT NULL, '
+                                   'features BLOB NOT NULL, PRIMARY KEY (code_hash, lang, version)) WITHOUT ROWID')
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get_many(self, lang, keys):
+        """The stored (tokens, sub_trees, dataflow) of the keys that are in the store, by key."""
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            connection = self._connect()
+            for i in range(0, len(keys), _SQL_BATCH):
+                batch = keys[i:i + _SQL_BATCH]
+                rows = connection.execute(
+                    'SELECT code_hash, features FROM features WHERE lang = ? AND version = ? '
+                    f'AND code_hash IN ({", ".join("?" * len(batch))})', [lang, self.version] + batch)
+                for key, data in rows:
+                    try:
+                        found[key] = pickle.loads(data)
+                    except (EOFError, pickle.UnpicklingError):
+                        pass
+        return found
+
+    def put_many(self, lang, features):
+        """Stores the tree features of a {key: SnippetFeatures} dict in one transaction."""
+        # ngram keys are process-local token ids, so only the tokens are kept
+        rows = [(key, lang, self.version,
+                 pickle.dumps((f.tokens, f.sub_trees, f.dataflow), protocol=pickle.HIGHEST_PROTOCOL))
+                for key, f in features.items()]
+        if not rows:
+            return
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR IGNORE INTO features VALUES (?, ?, ?, ?)', rows)
+
+    def close(self):
+        with self.lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+
+class FeatureCache:
+    """
+    Snippet features keyed by content hash, kept in an in-memory LRU and, if
+    cache_dir (or store) is given, in a FeatureStore that outlives the run.
+    Snippets found in the store are not parsed again; their ngrams are
+    recounted from the stored tokens.
+    :param keywords: keyword list for reference weights; None for hypotheses
+    """
+
+    def __init__(self, lang, keywords=None, cache_dir=None, max_entries=100000, store=None):
+        self.lang = lang
+        self.keywords = keywords
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        if store is None and cache_dir is not None:
+            store = FeatureStore(os.path.join(cache_dir, FEATURE_STORE_FILE))
+        self.store = store
+
+    def get(self, code):
+        return self.get_many([code])[0]
+
+    def get_many(self, codes):
+        """Features of every snippet, computing those not cached in one batch."""
+        keys = [preprocess.code_hash(code) for code in codes]
+        found = {}
+        for key in keys:
+            features = self.memory.get(key)
+            if features is not None:
+                self.memory.move_to_end(key)
+                found[key] = features
+
+        missing = {key: code for key, code in zip(keys, codes) if key not in found}
+        if missing:
+            loaded = self.store.get_many(self.lang, missing) if self.store is not None else {}
+            loaded_keys = list(loaded)
+            counted = _ngram_features([loaded[key][0] for key in loaded_keys], self.keywords, 4)
+            for key, ngram_features in zip(loaded_keys, counted):
+                tokens, sub_trees, dataflow = loaded[key]
+                found[key] = SnippetFeatures(tokens, ngram_features[0], ngram_features[1], sub_trees, dataflow)
+
+            new_keys = [key for key in missing if key not in loaded]
+            computed = dict(zip(new_keys, snippets_features([missing[key] for key in new_keys],
+                                                            self.lang, self.keywords)))
+            if self.store is not None:
+                self.store.put_many(self.lang, computed)
+            found.update(computed)
+
+            for key in missing:
+                self.memory[key] = found[key]
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+        return [found[key] for key in keys]
+
+
+class ReferenceCache(FeatureCache):
+    """
+    FeatureCache of references, with the keyword weights of keywords. Its
+    hypotheses attribute is a FeatureCache of hypotheses sharing the same
+    store, so unchanged hypotheses are not parsed again on later runs either.
+    """
+
+    def __init__(self, lang, keywords, cache_dir=None, max_entries=100000):
+        super().__init__(lang, keywords, cache_dir, max_entries)
+        self.hypotheses = FeatureCache(lang, None, max_entries=max_entries, store=self.store)
@@ -1,17 +1,285 @@
 # generate_docs.py
+# Builds the documentation corpus the Retriever searches (data/docs.json).
+#
+# Every configured module is imported and introspected in a worker process of
+# its own: its docstring, its public functions and classes, and recursively
+# the methods, properties and nested classes of those classes, each with its
+# signature. The entries of a module are written to a JSONL shard, and a
+# manifest records the version and source hash each shard was built from,
+# so later builds only re-import modules that changed. docs.json is then the
+# shards of the configured modules concatenated in order, with near-duplicate
+# entries folded into one (see doc_dedup.py), and written to the document
+# store next to it (see doc_store.py).
+#
+#   python generate_docs.py --modules builtins re json itertools numpy
+import argparse
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
+import inspect
 import json
-import builtins
+import os
+import platform
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-docs = []
+import doc_dedup
+import doc_store
 
-for name in dir(builtins):
-    obj = getattr(builtins, name)
-    doc = getattr(obj, '__doc__', '')
-    if doc:
-        docs.append({
-            "id": f"builtin_{name}",
-            "content": f"{name}:\n{doc}"
-        })
+# Bump whenever module_entries() changes, so every shard is rebuilt.
+BUILDER_VERSION = 1
 
-with open('data/docs.json', 'w') as f:
-    json.dump(docs, f, indent=2)
+DEFAULT_MODULES = [
+    'builtins', 'os', 'os.path', 'sys', 're', 'json', 'csv', 'math', 'random', 'statistics', 'string',
+    'itertools', 'functools', 'collections', 'heapq', 'bisect', 'datetime', 'time', 'pathlib', 'shutil',
+    'subprocess', 'typing', 'dataclasses', 'operator', 'copy', 'io', 'glob', 'argparse', 'logging',
+]
+
+
+def _doc(obj):
+    doc = getattr(obj, '__doc__', None)
+    return inspect.cleandoc(doc) if isinstance(doc, str) and doc.strip() else None
+
+
+def _signature(obj):
+    try:
+        return str(inspect.signature(obj))
+    except (TypeError, ValueError):
+        return ''  # many builtins have no introspectable signature
+
+
+def _public_members(module):
+    # (name, object) of what the module exports: __all__ if it has one, else
+    # its public names defined in the module itself (or its C accelerator
+    # module, e.g. _bisect for bisect) rather than imported.
+    names = getattr(module, '__all__', None)
+    own = names is None and module.__name__ != 'builtins'
+    if names is None:
+        names = [name for name in dir(module) if not name.startswith('_')]
+    for name in names:
+        try:
+            obj = getattr(module, name)
+        except AttributeError:
+            continue
+        if own and getattr(obj, '__module__', None) not in (module.__name__, '_' + module.__name__):
+            continue
+        yield name, obj
+
+
+def module_entries(module_name):
+    """
+    Imports a module and returns the doc entries of it and its members.
+    An entry is {"id", "content"}, where content is the dotted name and
+    signature of the object followed by its docstring. Builtins keep the ids
+    and bare names of the original builtins-only corpus.
+    :rtype: list(dict)
+    """
+    module = importlib.import_module(module_name)
+    if module_name == 'builtins':
+        id_prefix, name_prefix = 'builtin_', ''
+    else:
+        id_prefix = name_prefix = module_name + '.'
+    entries = []
+
+    def add(name, obj, with_signature):
+        doc = _doc(obj)
+        if doc:
+            signature = _signature(obj) if with_signature else ''
+            entries.append({
+                "id": id_prefix + name,
+                "content": f"{name_prefix}{name}{signature}:\n{doc}"
+            })
+
+    if module_name != 'builtins':
+        doc = _doc(module)
+        if doc:
+            entries.append({"id": module_name, "content": f"{module_name}:\n{doc}"})
+
+    stack = []
+    for name, obj in reversed(list(_public_members(module))):
+        if inspect.isclass(obj) or inspect.isroutine(obj):
+            stack.append((name, obj))
+    while stack:
+        name, obj = stack.pop()
+        add(name, obj, True)
+        if not inspect.isclass(obj):
+            continue
+        # Members defined by the class itself; inherited ones are documented
+        # with the class defining them.
+        members = []
+        for member_name, value in vars(obj).items():
+            if member_name.startswith('_'):
+                continue
+            qualified = f"{name}.{member_name}"
+            if inspect.isclass(value):
+                if getattr(value, '__qualname__', None) == f"{obj.__qualname__}.{member_name}":
+                    members.append((qualified, value))  # nested class, walked in turn
+            elif isinstance(value, (staticmethod, classmethod)) or inspect.isroutine(value):
+                add(qualified, getattr(obj, member_name, value), True)
+            elif inspect.isdatadescriptor(value):
+                add(qualified, value, False)
+        stack.extend(reversed(members))
+    return entries
+
+
+def module_version(module_name, packages=None):
+    """
+    Version of the distribution providing a module, or of Python for the stdlib.
+    :param packages: importlib.metadata.packages_distributions(), which scans
+        every installed distribution; pass it in when looking up many modules
+    """
+    if packages is None:
+        packages = importlib.metadata.packages_distributions()
+    top = module_name.partition('.')[0]
+    for distribution in packages.get(top, []):
+        try:
+            return f"{distribution} {importlib.metadata.version(distribution)}"
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return f"python {platform.python_version()}"
+
+
+def module_source_hash(module_name):
+    """
+    SHA-1 of the file a module is loaded from (the __init__.py of a package),
+    found without importing the module; None for modules built into the
+    interpreter. Raises ImportError if the module cannot be found.
+    """
+    spec = importlib.util.find_spec(module_name)
+    if spec is None:
+        raise ImportError(f"No module named {module_name!r}")
+    if not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    with open(spec.origin, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _write_atomic(path, write):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        write(f)
+    os.replace(temp_path, path)
+
+
+def _write_shard(path, entries):
+    def write(f):
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+    _write_atomic(path, write)
+
+
+def read_shard(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_manifest(build_dir):
+    try:
+        with open(os.path.join(build_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('builder_version') != BUILDER_VERSION:
+        return {}
+    return manifest.get('modules', {})
+
+
+def build_shards(module_names, build_dir, workers=None, force=False):
+    """
+    Brings the shard of every module in build_dir up to date, importing only
+    modules whose version or source hash differ from the manifest (or whose
+    shard is missing) in a pool of worker processes, one process per module.
+    Modules that cannot be found or imported are reported and left out.
+    :return: the manifest records of the modules that have a shard, by name
+    """
+    manifest = load_manifest(build_dir)
+    packages = importlib.metadata.packages_distributions()
+    stale = {}
+    for module_name in module_names:
+        try:
+            state = {"version": module_version(module_name, packages),
+                     "source_hash": module_source_hash(module_name)}
+        except (ImportError, ValueError) as e:
+            print(f"Skipping {module_name}: {e}")
+            continue
+        record = manifest.get(module_name)
+        if (force or record is None or {key: record.get(key) for key in state} != state
+                or not os.path.exists(os.path.join(build_dir, record['shard']))):
+            stale[module_name] = state
+
+    if stale:
+        print(f"Introspecting {len(stale)} of {len(module_names)} modules")
+        # A fresh process per module keeps imports from affecting each other.
+        pool_options = {'max_tasks_per_child': 1} if sys.version_info >= (3, 11) else {}
+        with ProcessPoolExecutor(max_workers=workers, **pool_options) as executor:
+            futures = {module_name: executor.submit(module_entries, module_name) for module_name in stale}
+            for module_name, future in futures.items():
+                try:
+                    entries = future.result()
+                except Exception as e:
+                    print(f"Skipping {module_name}: {type(e).__name__}: {e}")
+                    manifest.pop(module_name, None)
+                    continue
+                shard = os.path.join('shards', module_name + '.jsonl')
+                _write_shard(os.path.join(build_dir, shard), entries)
+                manifest[module_name] = dict(stale[module_name], shard=shard, entries=len(entries))
+
+    _write_atomic(os.path.join(build_dir, 'manifest.json'), lambda f: json.dump(
+        {"builder_version": BUILDER_VERSION, "modules": manifest}, f, indent=2, sort_keys=True))
+    return {module_name: manifest[module_name] for module_name in module_names if module_name in manifest}
+
+
+def _size_report(report):
+    before, after = report['before'], report['after']
+    lines = [f"Folded {report['clusters']} clusters of near-duplicate entries:"]
+    for label, old, new in zip(['entries', 'characters', 'vocabulary', 'TF-IDF nonzeros'], before, after):
+        reduction = 100.0 * (old - new) / old if old else 0.0
+        lines.append(f"  {label}: {old} -> {new} (-{reduction:.1f}%)")
+    return '\n'.join(lines)
+
+
+def build_corpus(module_names, output, build_dir, workers=None, force=False, dedup_threshold=0.85):
+    """
+    Builds the shards of module_names and writes their entries, in order, to
+    output, with near-duplicates folded into aliases unless dedup_threshold
+    is None.
+    """
+    records = build_shards(module_names, build_dir, workers, force)
+    docs = []
+    for record in records.values():
+        docs.extend(read_shard(os.path.join(build_dir, record['shard'])))
+    if dedup_threshold is not None:
+        docs, report = doc_dedup.deduplicate(docs, dedup_threshold)
+        print(_size_report(report))
+    _write_atomic(output, lambda f: json.dump(docs, f, indent=2))
+    # the memory-mapped store the Retriever reads, see doc_store.py
+    doc_store.build_doc_store(docs, doc_store.store_path(output), os.stat(output))
+    print(f"Wrote {len(docs)} entries from {len(records)} modules to {output}")
+    return docs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the documentation corpus of the retriever')
+    parser.add_argument('--modules', type=str, nargs='+', default=DEFAULT_MODULES,
+                        help='stdlib or installed modules to document, in corpus order')
+    parser.add_argument('--output', type=str, default='data/docs.json')
+    parser.add_argument('--build-dir', type=str, default='data/doc_shards',
+                        help='directory of the per-module JSONL shards and their manifest')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes introspecting modules (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='rebuild every shard')
+    parser.add_argument('--dedup-threshold', type=float, default=0.85,
+                        help='docstring similarity (estimated Jaccard of word 3-grams) above which '
+                             'entries are folded into one with alias ids')
+    parser.add_argument('--no-dedup', action='store_true', help='keep near-duplicate entries')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    build_corpus(args.modules, args.output, args.build_dir, args.workers, args.force,
+                 None if args.no_dedup else args.dedup_threshold)
@@ -6,16 +6,22 @@ class Generator:
         model_name = "Salesforce/codegen-350M-mono"
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        # Batched prompts are padded on the left, so generation continues
+        # right after every prompt.
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.model.to(self.device)
 
-    def prompt_engineer(self, nl_intent, docs):
+    def prompt_engineer(self, nl_intent, docs, verbose=True):
         docs_content = docs if isinstance(docs, list) else []
 
         if docs_content:
-            print("\nRetrieved Documentation Used:")
-            for i, doc in enumerate(docs_content):
-                print(f"Doc {i+1}: {doc.strip()}\n")
+            if verbose:
+                print("\nRetrieved Documentation Used:")
+                for i, doc in enumerate(docs_content):
+                    print(f"Doc {i+1}: {doc.strip()}\n")
 
             doc_section = '\n'.join(docs_content)
             documentation_prompt = f"Documentation:\n{doc_section}\n"
@@ -38,3 +44,13 @@ class Generator:
         outputs = self.model.generate(**inputs, max_new_tokens=100, do_sample=False)
         decoded = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
         return decoded.split("Code:")[-1].strip()
+
+    def generate_batch(self, nl_intents, docs_lists):
+        """generate() of several intents, each with its own docs, in one padded batch."""
+        prompts = [self.prompt_engineer(nl_intent, docs, verbose=False)
+                   for nl_intent, docs in zip(nl_intents, docs_lists)]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        outputs = self.model.generate(**inputs, max_new_tokens=100, do_sample=False,
+                                      pad_token_id=self.tokenizer.pad_token_id)
+        decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        return [text.split("Code:")[-1].strip() for text in decoded]
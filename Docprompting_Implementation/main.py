@@ -2,17 +2,140 @@ from datasets import load_dataset
 from retriever import Retriever
 from generator import Generator
 
+import argparse
+import json
+import os
+import sys
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate code with and without DocPrompting')
+    parser.add_argument('--input', type=str, default=None,
+                        help='batch mode: file of intents ("-" for stdin), one per line or JSONL records '
+                             'with "id" and "intent" (or "nl_intent"); without it, asks for one intent')
+    parser.add_argument('--output', type=str, default='predictions.jsonl',
+                        help='batch mode: JSONL file results are appended to; ids already in it are skipped')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--top-k', type=int, default=2, help='number of docs retrieved per intent')
+    return parser.parse_args()
+
+def read_intents(path):
+    # Yields (id, intent). A line that parses as a JSON object is a JSONL
+    # record; any other non-empty line is an intent, identified by its line
+    # number. Records without an intent are reported and skipped.
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = None
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    pass  # a plain-text intent that starts with '{'
+            if isinstance(record, dict):
+                intent = record['intent'] if 'intent' in record else record.get('nl_intent')
+                if intent is None:
+                    print(f"Skipping line {line_number} of {path}: the record has no \"intent\" or \"nl_intent\"",
+                          file=sys.stderr)
+                    continue
+                yield record.get('id', line_number), intent
+            else:
+                yield line_number, line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def completed_ids(output_path):
+    # Ids of the results already in the output. A last line cut off by an
+    # interruption (it has no newline) is truncated away so appending
+    # continues cleanly; any other unreadable line is reported and skipped.
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'rb+') as f:
+        end = 0
+        for line_number, line in enumerate(f, 1):
+            if not line.endswith(b'\n'):
+                f.truncate(end)
+                break
+            end += len(line)
+            if not line.strip():
+                continue
+            try:
+                done.add(str(json.loads(line)['id']))
+            except (ValueError, KeyError, TypeError):
+                print(f"Skipping unreadable line {line_number} of {output_path}; its intent is redone",
+                      file=sys.stderr)
+    return done
+
+def batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_batch(args, retriever, generator):
+    # Results are streamed to the output as each batch completes; timings
+    # are the batch's wall-clock time per stage, shared out per example.
+    done = completed_ids(args.output)
+    pending = ((intent_id, intent) for intent_id, intent in read_intents(args.input)
+               if str(intent_id) not in done)
+    written = 0
+    with open(args.output, 'a', encoding='utf-8') as out:
+        for batch in batches(pending, args.batch_size):
+            ids, intents = zip(*batch)
+
+            start = time.perf_counter()
+            doc_indices = retriever.retrieve_batch_indices(list(intents), top_k=args.top_k)
+            docs = [[retriever.store.content(i) for i in indices] for indices in doc_indices]
+            retrieved = time.perf_counter()
+            with_docs = generator.generate_batch(intents, docs)
+            generated_with = time.perf_counter()
+            without_docs = generator.generate_batch(intents, [[] for _ in intents])
+            generated_without = time.perf_counter()
+
+            timings = {
+                "retrieval": (retrieved - start) / len(batch),
+                "generation_with_docs": (generated_with - retrieved) / len(batch),
+                "generation_without_docs": (generated_without - generated_with) / len(batch),
+            }
+            for k, intent_id in enumerate(ids):
+                out.write(json.dumps({
+                    "id": intent_id,
+                    "intent": intents[k],
+                    "docs": [retriever.store.doc_id(i) for i in doc_indices[k]],
+                    "with_docs": with_docs[k],
+                    "without_docs": without_docs[k],
+                    "timings": timings,
+                }) + "\n")
+            out.flush()
+            written += len(batch)
+            print(f"{written} intents done ({len(done)} skipped from an earlier run)", file=sys.stderr)
+
 def main():
+    args = parse_args()
+
     # Initialize components
     retriever = Retriever('data/docs.json')  # Assuming your docs are in this file
     generator = Generator()
 
+    if args.input is not None:
+        run_batch(args, retriever, generator)
+        return
+
     # User input
     user_input = input("Enter your task in natural language: ")
     print(f"Task: {user_input}")
 
     # Retrieve documents based on the input
-    docs = retriever.retrieve(user_input)
+    docs = retriever.retrieve(user_input, top_k=args.top_k)
 
     # With DocPrompting
     pred_with_docs = generator.generate(user_input, docs)
@@ -25,7 +148,7 @@ def main():
     # Save generated code to compare with references later
     with open("predictions_with_docs.txt", "w") as f:
         f.write(pred_with_docs)
-    
+
     with open("predictions_without_docs.txt", "w") as f:
         f.write(pred_without_docs)
 
@@ -1,9 +1,13 @@
 from generator import Generator
 from retriever import Retriever
+import codebleu
+from calc_code_bleu import print_comparison
 
-import os
+import queue
 import subprocess 
 import sys 
+import threading
+import time
 
 
 def get_evaluation_examples():
@@ -51,10 +55,12 @@ def get_evaluation_examples():
     return examples
 
 
-def run_codebleu_script(refs_file, hyp_file, lang="python"):
+def run_codebleu_script(refs_file, hyp_files, lang="python"):
     """
     Calls the calc_code_bleu.py script using subprocess.
     Assumes calc_code_bleu.py is in the same directory or in PATH.
+    hyp_files maps system names to hypothesis files; all systems are scored
+    against the references in one run.
     """
     script_path = "calc_code_bleu.py" 
     
@@ -63,7 +69,7 @@ def run_codebleu_script(refs_file, hyp_file, lang="python"):
         sys.executable, 
         script_path,
         "--refs", refs_file,
-        "--hyp", hyp_file,
+        "--hyp", *[f"{name}={path}" for name, path in hyp_files.items()],
         "--lang", lang
     ]
     print(f"Running command: {' '.join(command)}")
@@ -73,13 +79,60 @@ def run_codebleu_script(refs_file, hyp_file, lang="python"):
         print(result.stdout)
         
     except subprocess.CalledProcessError as e:
-        print(f"Error running CodeBLEU script for {hyp_file}:")
+        print(f"Error running CodeBLEU script for {', '.join(hyp_files.values())}:")
         print(e.stderr)
     except FileNotFoundError:
         print(f"Error: The script '{script_path}' was not found. Make sure it's in the correct path.")
 
 
-def evaluate_codebleu():
+# Sentinel closing the queues of the evaluation pipeline.
+_DONE = object()
+
+
+def _retrieve_ahead(retriever, examples, out_queue, top_k):
+    # Pipeline stage 1: retrieves the docs of upcoming examples, once per
+    # distinct intent, while the model generates for earlier ones. The
+    # bounded queue keeps it at most a few examples ahead.
+    try:
+        retrieved = {}
+        for example in examples:
+            nl_intent = example["nl_intent"]
+            if nl_intent not in retrieved:
+                retrieved[nl_intent] = retriever.retrieve(nl_intent, top_k=top_k)
+            out_queue.put((example, retrieved[nl_intent]))
+    except BaseException as e:
+        out_queue.put(e)
+        return
+    out_queue.put(_DONE)
+
+
+def _featurize_finished(reference_cache, in_queue, errors):
+    # Pipeline stage 3: extracts the CodeBLEU features of finished examples
+    # into the cache while the model generates for later ones, so scoring at
+    # the end only matches cached features.
+    while True:
+        item = in_queue.get()
+        if item is _DONE:
+            return
+        if errors:
+            continue  # keep draining so generation never blocks
+        reference, hypotheses = item
+        try:
+            reference_cache.get_many([reference])
+            reference_cache.hypotheses.get_many(hypotheses)
+        except BaseException as e:
+            errors.append(e)
+
+
+def evaluate_codebleu(top_k=3, prefetch=4):
+    """
+    Generates code with and without docs for the evaluation examples and
+    scores both systems with CodeBLEU. Retrieval runs ahead of generation and
+    feature extraction behind it, each on its own thread connected by bounded
+    queues, so the wall-clock time approaches generation time alone.
+    :param prefetch: examples retrieval and feature extraction may run ahead
+        of or behind generation
+    """
     print("Initializing Generator and Retriever...")
     
     generator = Generator() 
@@ -88,69 +141,64 @@ def evaluate_codebleu():
 
     examples = get_evaluation_examples()
 
+    lang = "python"
+    keywords = codebleu.load_keywords(lang)
+    reference_cache = codebleu.ReferenceCache(lang, keywords)
+
     generated_code_with_docs_list = []
     generated_code_without_docs_list = []
     reference_codes_list = []
 
     print("\n--- Generating Code for Evaluation ---\n")
 
-    for i, example in enumerate(examples, 1):
-        nl_intent = example["nl_intent"]
-        reference_code = example["reference_code"] 
-        reference_codes_list.append(reference_code)
-
-        print(f"Processing Example {i}/{len(examples)}: {nl_intent[:60]}...")
-
-       
-        retrieved_doc_contents = retriever.retrieve(nl_intent, top_k=3) 
-        top_docs_for_generator = retriever.retrieve(nl_intent, top_k=3) 
-                                                                   
-
-        gen_with_docs_raw = generator.generate(nl_intent, top_docs_for_generator)
-        
-        generated_code_with_docs_list.append(gen_with_docs_raw) 
-
-        
-        gen_without_docs_raw = generator.generate(nl_intent, []) 
-        
-        generated_code_without_docs_list.append(gen_without_docs_raw)
-
-        
-    newline_placeholder = "<NEWLINE_CODEBLEU>"
-    
-    processed_refs = [r.replace("\n", newline_placeholder) for r in reference_codes_list]
-    processed_hyps_with = [h.replace("\n", newline_placeholder) for h in generated_code_with_docs_list]
-    processed_hyps_without = [h.replace("\n", newline_placeholder) for h in generated_code_without_docs_list]
-
-    ref_file_path = "temp_refs.txt"
-    hyp_with_file_path = "temp_hyps_with.txt"
-    hyp_without_file_path = "temp_hyps_without.txt"
-
-    with open(ref_file_path, "w", encoding="utf-8") as f:
-        for line in processed_refs:
-            f.write(line + "\n")
-    with open(hyp_with_file_path, "w", encoding="utf-8") as f:
-        for line in processed_hyps_with:
-            f.write(line + "\n")
-    with open(hyp_without_file_path, "w", encoding="utf-8") as f:
-        for line in processed_hyps_without:
-            f.write(line + "\n")
-    
-    print("\n=== Calculating CodeBLEU Scores via Script ===")
-    print("\n--- With DocPrompting ---")
-    run_codebleu_script(refs_file=ref_file_path, hyp_file=hyp_with_file_path, lang="python")
-    
-    print("\n--- Without DocPrompting ---")
-    run_codebleu_script(refs_file=ref_file_path, hyp_file=hyp_without_file_path, lang="python")
-
-    
+    retrieved_queue = queue.Queue(maxsize=prefetch)
+    finished_queue = queue.Queue(maxsize=prefetch)
+    featurize_errors = []
+    retrieval = threading.Thread(target=_retrieve_ahead, args=(retriever, examples, retrieved_queue, top_k),
+                                 daemon=True)
+    featurization = threading.Thread(target=_featurize_finished,
+                                     args=(reference_cache, finished_queue, featurize_errors), daemon=True)
+    retrieval.start()
+    featurization.start()
+
+    start = time.perf_counter()
+    generation_seconds = 0.0
     try:
-        os.remove(ref_file_path)
-        os.remove(hyp_with_file_path)
-        os.remove(hyp_without_file_path)
-        print("\nTemporary files cleaned up.")
-    except OSError as e:
-        print(f"Error removing temporary files: {e}")
+        for i in range(1, len(examples) + 1):
+            item = retrieved_queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            example, top_docs_for_generator = item
+            nl_intent = example["nl_intent"]
+            reference_code = example["reference_code"] 
+            reference_codes_list.append(reference_code)
+
+            print(f"Processing Example {i}/{len(examples)}: {nl_intent[:60]}...")
+
+            generation_start = time.perf_counter()
+            gen_with_docs_raw = generator.generate(nl_intent, top_docs_for_generator)
+            generated_code_with_docs_list.append(gen_with_docs_raw) 
+
+            gen_without_docs_raw = generator.generate(nl_intent, []) 
+            generated_code_without_docs_list.append(gen_without_docs_raw)
+            generation_seconds += time.perf_counter() - generation_start
+
+            finished_queue.put((reference_code, [gen_with_docs_raw, gen_without_docs_raw]))
+    finally:
+        finished_queue.put(_DONE)
+    featurization.join()
+    if featurize_errors:
+        raise featurize_errors[0]
+
+    print("\n=== Calculating CodeBLEU Scores ===")
+    # every snippet was featurized during generation; this only matches
+    systems = ["with_docs", "without_docs"]
+    stats = codebleu.systems_stats([[ref] for ref in reference_codes_list],
+                                   [generated_code_with_docs_list, generated_code_without_docs_list],
+                                   lang, keywords, reference_cache)
+    params = (0.25, 0.25, 0.25, 0.25)
+    print_comparison(systems, [codebleu.scores_from_stats(system_stats) for system_stats in stats], params)
+    print(f"\nWall-clock time {time.perf_counter() - start:.1f}s, of which generation {generation_seconds:.1f}s")
 
 if __name__ == "__main__":
-    evaluate_codebleu()
\ No newline at end of file
+    evaluate_codebleu()
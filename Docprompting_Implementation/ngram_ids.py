@@ -0,0 +1,104 @@
+# Integer-id ngram extraction for BLEU and weighted ngram match.
+#
+# utils.ngrams builds a tuple of strings per ngram and every order is extracted
+# separately. Here tokens are interned to integer ids once per process and the
+# ngrams of all orders of a whole batch of snippets are cut from one packed id
+# array with NumPy: the key of a unigram is its token id and the key of a longer
+# ngram the bytes of its window of uint32 ids, so keys are exact (no hashing)
+# and cheap to hash and compare. The
+# counts have the same values and insertion order as bleu.ngram_counts(), so
+# scores computed from them are bit-for-bit identical.
+#
+# Ids are only meaningful within the process that interned them; features
+# keyed by them must not be shared between processes or persisted.
+
+from collections import Counter
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+ID_DTYPE = np.uint32
+
+
+class TokenVocab:
+    """Maps tokens to dense integer ids, in order of first appearance."""
+
+    def __init__(self):
+        self.ids = {}
+        self.tokens = []  # Index = id, and value = token.
+
+    def intern(self, tokens, out=None):
+        """Appends the ids of tokens to out (a new list by default) and returns it."""
+        ids = self.ids
+        if out is None:
+            out = []
+        for token in tokens:
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(ids)
+                self.tokens.append(token)
+            out.append(token_id)
+        return out
+
+    def __len__(self):
+        return len(self.ids)
+
+
+_vocab = TokenVocab()
+
+
+def default_vocab():
+    """The process-wide vocabulary used when none is given."""
+    return _vocab
+
+
+def unigram_keys(tokens, vocab=None):
+    """The keys of the unigrams of tokens in counts returned by batch_ngram_counts()."""
+    if vocab is None:
+        vocab = _vocab
+    return vocab.intern(tokens)
+
+
+def batch_ngram_counts(token_lists, max_n=4, vocab=None):
+    """
+    Count the ngrams of every order from 1 to max_n of many token lists at once.
+    :param token_lists: tokenized snippets
+    :type token_lists: list(list(str))
+    :param vocab: TokenVocab interning the tokens; the process-wide one by default
+    :return: for every snippet, its ngram counts of order n at index n - 1, as
+        bleu.ngram_counts() but keyed by packed ids
+    :rtype: list(list(Counter))
+    """
+    if vocab is None:
+        vocab = _vocab
+    flat = []
+    for tokens in token_lists:
+        vocab.intern(tokens, flat)
+    ids = np.array(flat, dtype=ID_DTYPE)
+
+    # Window i of order n covers ids[i:i + n]; viewing each window as one
+    # opaque value of n * 4 bytes gives its key. Windows crossing snippet
+    # boundaries are skipped below by slicing.
+    windows = [flat]
+    for n in range(2, max_n + 1):
+        if len(ids) < n:
+            windows.append([])
+            continue
+        packed = np.ascontiguousarray(sliding_window_view(ids, n))
+        windows.append(packed.view(np.dtype((np.void, n * ids.itemsize))).ravel().tolist())
+
+    counts = []
+    offset = 0
+    for tokens in token_lists:
+        length = len(tokens)
+        counts.append([
+            Counter(windows[n - 1][offset:offset + length - n + 1]) if length >= n else Counter()
+            for n in range(1, max_n + 1)
+        ])
+        offset += length
+    return counts
+
+
+def ngram_counts(tokens, max_n=4, vocab=None):
+    """batch_ngram_counts() of a single token list."""
+    return batch_ngram_counts([tokens], max_n, vocab)[0]
@@ -0,0 +1,142 @@
+# ngram_match.py
+# One ngram matching pass for BLEU and the keyword-weighted ngram match.
+#
+# bleu.py and weighted_ngram_match.py score the same ngrams of the same
+# hypotheses and references: BLEU clips every hypothesis count by the largest
+# count in any reference (precision), the weighted match clips every reference
+# count by the hypothesis count and weights unigrams by keyword (recall).
+# match_counts() collects both from ngram counts in a single walk over each
+# reference; match_tokens() does the same starting from tokens. Both
+# corpus_bleu() functions and the CodeBLEU features are built on them.
+
+from collections import Counter, namedtuple
+
+# Per ngram order n at index n - 1: BLEU's clipped matches and hypothesis
+# ngram counts, and the weighted match's clipped matches and reference counts.
+NgramMatch = namedtuple('NgramMatch', ['p_numerators', 'p_denominators', 'r_numerators', 'r_denominators'])
+
+
+def count_ngrams(tokens, max_n=4):
+    """
+    The ngram counts of every order from 1 to max_n, as bleu.ngram_counts().
+    :return: the ngram counts of order n at index n - 1
+    :rtype: list(Counter)
+    """
+    return [Counter(zip(*[tokens[k:] for k in range(n)])) for n in range(1, max_n + 1)]
+
+
+def _unigram_weights(weights, reference_counts):
+    # The weight lookup of weighted_ngram_match.clipped_recall() for unigrams:
+    # a list is indexed by integer unigram keys (see features.KeywordWeights),
+    # a dict of the reference's tokens by the token of a tuple unigram. None
+    # means the counts are not weighted.
+    if isinstance(weights, list):
+        return weights.__getitem__
+    if weights is not None and len(weights) == len(reference_counts):
+        return lambda ngram: weights[ngram[0]] if ngram[0] in weights else 1
+    return None
+
+
+def match_counts(references_counts, counts, references_weights=None, precision=True, recall=True):
+    """
+    BLEU and weighted ngram match statistics of one example from ngram counts.
+    Each reference's counts are walked once per order for both metrics.
+    :param references_counts: the ngram counts of every order of each reference
+    :type references_counts: list(list(Counter))
+    :param counts: the ngram counts of every order of the hypothesis
+    :type counts: list(Counter)
+    :param references_weights: the token weights of each reference, see
+        weighted_ngram_match.clipped_recall(); None for unweighted recall
+    :param precision: whether to collect BLEU's statistics
+    :param recall: whether to collect the weighted match's statistics
+    :rtype: NgramMatch
+    """
+    max_n = len(counts)
+    if references_weights is None:
+        references_weights = [None] * len(references_counts)
+    p_numerators, p_denominators = [0] * max_n, [0] * max_n
+    r_numerators, r_denominators = [0] * max_n, [0] * max_n
+
+    for i in range(max_n):
+        hyp_counts = counts[i]
+        max_counts = {}
+        for reference_counts, weights in zip(references_counts, references_weights):
+            reference_counts = reference_counts[i]
+            weight = _unigram_weights(weights, reference_counts) if recall and i == 0 else None
+            numerator, denominator = 0, 0
+            for ngram, count in reference_counts.items():
+                hyp_count = hyp_counts.get(ngram, 0)
+                if precision and hyp_count and count > max_counts.get(ngram, 0):
+                    max_counts[ngram] = count
+                if recall:
+                    # Same summation order as clipped_recall(), so weighted
+                    # float sums are bit-for-bit identical.
+                    if weight is None:
+                        numerator += min(count, hyp_count)
+                        denominator += count
+                    else:
+                        w = weight(ngram)
+                        numerator += min(count, hyp_count) * w
+                        denominator += count * w
+            r_numerators[i] += numerator
+            r_denominators[i] += max(1, denominator)
+
+        if precision:
+            numerator = 0
+            for ngram, count in hyp_counts.items():
+                numerator += min(count, max_counts.get(ngram, 0))
+            p_numerators[i] = numerator
+            # Ensures that denominator is minimum 1 to avoid ZeroDivisionError.
+            p_denominators[i] = max(1, sum(hyp_counts.values()))
+
+    return NgramMatch(p_numerators, p_denominators, r_numerators, r_denominators)
+
+
+def _pruned_precision(references, hypothesis, max_n):
+    # BLEU's statistics straight from tokens. The hypothesis ngrams of all
+    # orders share one Counter (orders are tuples of different lengths and
+    # never collide) and each reference is walked once, growing the ngrams at
+    # every position one token at a time; an ngram missing from the hypothesis
+    # ends the walk, as no longer ngram starting there can be in it either.
+    hyp_len = len(hypothesis)
+    counts = Counter()
+    for n in range(1, max_n + 1):
+        counts.update(zip(*[hypothesis[k:] for k in range(n)]))
+
+    max_counts = {}
+    for reference in references:
+        reference_counts = {}
+        ref_len = len(reference)
+        for i in range(ref_len):
+            ngram = (reference[i],)
+            for n in range(1, min(max_n, ref_len - i) + 1):
+                if n > 1:
+                    ngram = ngram + (reference[i + n - 1],)
+                if ngram not in counts:
+                    break
+                reference_counts[ngram] = reference_counts.get(ngram, 0) + 1
+        for ngram, count in reference_counts.items():
+            if count > max_counts.get(ngram, 0):
+                max_counts[ngram] = count
+
+    numerators = [0] * max_n
+    for ngram, count in counts.items():
+        numerators[len(ngram) - 1] += min(count, max_counts.get(ngram, 0))
+    denominators = [max(1, hyp_len - n + 1) for n in range(1, max_n + 1)]
+    return numerators, denominators
+
+
+def match_tokens(references, hypothesis, references_weights=None, max_n=4, precision=True, recall=True):
+    """
+    match_counts() of tokenized references and hypothesis. BLEU alone only
+    counts the reference ngrams that occur in the hypothesis.
+    :type references: list(list(str))
+    :type hypothesis: list(str)
+    :param references_weights: dicts of token weights, one per reference
+    :rtype: NgramMatch
+    """
+    if precision and not recall:
+        p_numerators, p_denominators = _pruned_precision(references, hypothesis, max_n)
+        return NgramMatch(p_numerators, p_denominators, [0] * max_n, [0] * max_n)
+    return match_counts([count_ngrams(reference, max_n) for reference in references],
+                        count_ngrams(hypothesis, max_n), references_weights, precision, recall)
@@ -0,0 +1,315 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+# Data flow graph extraction for dataflow match, after the recursive CodeXGLUE
+# CodeBLEU DFG functions, with the same output. A node is evaluated by a frame:
+# a generator that yields (child, states) for every child it needs evaluated,
+# receives (DFG, states) back and finally returns its own (DFG, states). The
+# frames wait on an explicit stack, so code of any depth is handled without
+# Python recursion, and tokens (most nodes) are evaluated without a frame.
+#
+# A DFG item is (name, token position, relationship, parent names, parent
+# token positions). The states dict maps each variable to the token positions
+# it was last assigned at. A node takes ownership of the states it is given
+# and may update them in place; it returns the states that hold after it.
+#
+# Frames look tokens up in a token index: DFG_python() uses the index_to_code
+# dict of the CodeXGLUE interface, python_data_flow() reads tokens straight
+# from the UTF-8 code by byte offset.
+
+from operator import itemgetter
+
+from .utils import _iter_tokens
+
+_by_index = itemgetter(1)
+
+
+class _TokenIndex:
+    """(position, text) of the code tokens of a tree, from an index_to_code dict."""
+
+    def __init__(self, index_to_code):
+        self.index_to_code = index_to_code
+
+    def get(self, node):
+        return self.index_to_code[(node.start_point, node.end_point)]
+
+    def variables(self, root_node):
+        """get() of the tokens under root_node that are not keywords or punctuation."""
+        result = []
+        for node in _iter_tokens(root_node):
+            token = self.get(node)
+            if node.type != token[1]:
+                result.append(token)
+        return result
+
+
+# Leaves that only occur inside strings, which tree_to_token_index() takes as
+# one token. They are missing from an index_to_code dict.
+_STRING_PARTS = frozenset(['string_start', 'string_content', 'string_end', 'escape_sequence'])
+
+
+class _ByteTokenIndex(_TokenIndex):
+    """
+    _TokenIndex reading tokens from the UTF-8 code the tree was parsed from.
+    A token's position is its start byte, doubled so that an empty (missing)
+    token sorts before the token starting where it is; positions sort like
+    the token numbers of tree_to_token_index().
+    """
+
+    def __init__(self, code):
+        self.code = code
+
+    def get(self, node):
+        if node.type in _STRING_PARTS:
+            # As with index_to_code, e.g. when an assignment pairs the parts
+            # of `a.b = 'c'` element-wise: the extraction fails.
+            raise KeyError((node.start_point, node.end_point))
+        start, end = node.start_byte, node.end_byte
+        text = self.code[start:end].decode('utf8', 'replace')
+        if '\n' in text:
+            # index_to_code_token() joins the lines of a token without newlines.
+            text = text.replace('\n', '')
+        return 2 * start + (end > start), text
+
+
+def _run(frame_functions, token_function, root_node, tokens, states):
+    stack = []
+    call = (root_node, states)
+    result = None
+    while True:
+        if call is not None:
+            node, states = call
+            node_type = node.type
+            if (node.child_count == 0 or node_type == 'string') and node_type != 'comment':
+                result = token_function(node, tokens, states)
+                if not stack:
+                    return result
+            else:
+                frame_function = frame_functions.get(node_type, frame_functions[None])
+                stack.append(frame_function(node, tokens, states))
+                result = None
+        try:
+            call = stack[-1].send(result)
+        except StopIteration as stop:
+            stack.pop()
+            call = None
+            result = stop.value
+            if not stack:
+                return result
+
+
+def _merge_loop_dfg(DFG):
+    # Loop bodies are evaluated twice; merge the items of the same token.
+    dic = {}
+    for x in DFG:
+        if (x[0], x[1], x[2]) not in dic:
+            dic[(x[0], x[1], x[2])] = [x[3], x[4]]
+        else:
+            dic[(x[0], x[1], x[2])][0] = list(set(dic[(x[0], x[1], x[2])][0] + x[3]))
+            dic[(x[0], x[1], x[2])][1] = sorted(list(set(dic[(x[0], x[1], x[2])][1] + x[4])))
+    return [(x[0], x[1], x[2], y[0], y[1]) for x, y in sorted(dic.items(), key=lambda t: t[0][1])]
+
+
+def _assignments(left_nodes, right_nodes, tokens, states):
+    # Every variable on the left is computed from the variables on its right.
+    DFG = []
+    for left_node, right_node in zip(left_nodes, right_nodes):
+        right_tokens = tokens.variables(right_node)
+        for idx1, code1 in tokens.variables(left_node):
+            DFG.append((code1, idx1, 'computedFrom', [code for _, code in right_tokens],
+                        [idx for idx, _ in right_tokens]))
+            states[code1] = [idx1]
+    return DFG
+
+
+def _paired_sides(root_node):
+    # The left and right nodes of an assignment or for statement, paired up
+    # element-wise when both sides have the same number of elements.
+    left = root_node.child_by_field_name('left')
+    right = root_node.child_by_field_name('right')
+    left_nodes = [x for x in left.children if x.type != ',']
+    right_nodes = [x for x in right.children if x.type != ',']
+    if len(right_nodes) != len(left_nodes):
+        left_nodes = [left]
+        right_nodes = [right]
+    if len(left_nodes) == 0:
+        left_nodes = [left]
+    if len(right_nodes) == 0:
+        right_nodes = [right]
+    return left_nodes, right_nodes
+
+
+def _python_token(root_node, tokens, states):
+    idx, code = tokens.get(root_node)
+    if root_node.type == code:
+        return [], states
+    elif code in states:
+        return [(code, idx, 'comesFrom', [code], states[code].copy())], states
+    else:
+        if root_node.type == 'identifier':
+            states[code] = [idx]
+        return [(code, idx, 'comesFrom', [], [])], states
+
+
+def _python_default_parameter(root_node, tokens, states):
+    name = root_node.child_by_field_name('name')
+    value = root_node.child_by_field_name('value')
+    DFG = []
+    if value is None:
+        for idx, code in tokens.variables(name):
+            DFG.append((code, idx, 'comesFrom', [], []))
+            states[code] = [idx]
+        return sorted(DFG, key=_by_index), states
+    else:
+        name_tokens = tokens.variables(name)
+        value_tokens = tokens.variables(value)
+        temp, states = yield value, states
+        DFG += temp
+        for idx1, code1 in name_tokens:
+            for idx2, code2 in value_tokens:
+                DFG.append((code1, idx1, 'comesFrom', [code2], [idx2]))
+            states[code1] = [idx1]
+        return sorted(DFG, key=_by_index), states
+
+
+def _python_assignment(root_node, tokens, states):
+    if root_node.type == 'for_in_clause':
+        right_nodes = [root_node.children[-1]]
+        left_nodes = [root_node.child_by_field_name('left')]
+    else:
+        if root_node.child_by_field_name('right') is None:
+            return [], states
+        left_nodes, right_nodes = _paired_sides(root_node)
+    DFG = []
+    for node in right_nodes:
+        temp, states = yield node, states
+        DFG += temp
+    DFG += _assignments(left_nodes, right_nodes, tokens, states)
+    return sorted(DFG, key=_by_index), states
+
+
+def _python_if_statement(root_node, tokens, states):
+    DFG = []
+    current_states = states.copy()
+    others_states = []
+    tag = False
+    if 'else' in root_node.type:
+        tag = True
+    for child in root_node.children:
+        if 'else' in child.type:
+            tag = True
+        if child.type not in ['elif_clause', 'else_clause']:
+            temp, current_states = yield child, current_states
+            DFG += temp
+        else:
+            # Every branch starts from the states before the if statement.
+            temp, new_states = yield child, states.copy()
+            DFG += temp
+            others_states.append(new_states)
+    others_states.append(current_states)
+    if tag is False:
+        others_states.append(states)
+    new_states = {}
+    for dic in others_states:
+        for key in dic:
+            if key not in new_states:
+                new_states[key] = dic[key].copy()
+            else:
+                new_states[key] += dic[key]
+    for key in new_states:
+        new_states[key] = sorted(list(set(new_states[key])))
+    return sorted(DFG, key=_by_index), new_states
+
+
+def _python_for_statement(root_node, tokens, states):
+    DFG = []
+    for i in range(2):
+        left_nodes, right_nodes = _paired_sides(root_node)
+        for node in right_nodes:
+            temp, states = yield node, states
+            DFG += temp
+        DFG += _assignments(left_nodes, right_nodes, tokens, states)
+        if root_node.children[-1].type == "block":
+            temp, states = yield root_node.children[-1], states
+            DFG += temp
+    return sorted(_merge_loop_dfg(DFG), key=_by_index), states
+
+
+def _python_while_statement(root_node, tokens, states):
+    DFG = []
+    for i in range(2):
+        for child in root_node.children:
+            temp, states = yield child, states
+            DFG += temp
+    return sorted(_merge_loop_dfg(DFG), key=_by_index), states
+
+
+def _python_children(root_node, tokens, states):
+    DFG = []
+    children = root_node.children
+    # for_in_clauses (of comprehensions) bind their variables first.
+    for child in children:
+        if child.type == 'for_in_clause':
+            temp, states = yield child, states
+            DFG += temp
+    for child in children:
+        if child.type != 'for_in_clause':
+            temp, states = yield child, states
+            DFG += temp
+    return sorted(DFG, key=_by_index), states
+
+
+_python_frames = {
+    'default_parameter': _python_default_parameter,
+    'assignment': _python_assignment,
+    'augmented_assignment': _python_assignment,
+    'for_in_clause': _python_assignment,
+    'if_statement': _python_if_statement,
+    'for_statement': _python_for_statement,
+    'while_statement': _python_while_statement,
+    None: _python_children,
+}
+
+
+def DFG_python(root_node, index_to_code, states):
+    """
+    The data flow graph of Python code.
+    :param root_node: tree-sitter node to extract the data flow of
+    :param index_to_code: (start_point, end_point) of every code token to its
+        (position, text), see utils.tree_to_token_index()
+    :param states: the token positions of the variables assigned so far; not modified
+    :return: (DFG items sorted by token position, states after root_node)
+    """
+    return _run(_python_frames, _python_token, root_node, _TokenIndex(index_to_code), states.copy())
+
+
+def python_data_flow(root_node, code):
+    """
+    The merged data flow of Python code, as dataflow_match.get_data_flow()
+    returns it: the DFG_python() items of tokens with data flow edges, with
+    the items of the same token merged. Tokens are read from the code by byte
+    offset while the tree is walked, and positions are byte based (see
+    _ByteTokenIndex), which the normalized data flow does not depend on.
+    :param code: the UTF-8 bytes root_node was parsed from
+    :rtype: list
+    """
+    DFG, _ = _run(_python_frames, _python_token, root_node, _ByteTokenIndex(code), {})
+    # Items sort by position already; keep the tokens that are sources or
+    # targets of an edge, merging their items in one pass.
+    indexs = set()
+    merged = {}
+    for d in DFG:
+        if d[-1]:
+            indexs.add(d[1])
+            indexs.update(d[-1])
+        if d[1] not in merged:
+            merged[d[1]] = d
+        else:
+            m = merged[d[1]]
+            merged[d[1]] = (d[0], d[1], d[2], list(set(m[3] + d[3])), list(set(m[4] + d[4])))
+    return [d for idx, d in merged.items() if idx in indexs]
+
+
+# Only Python has a data flow extractor so far; dataflow match scores 0 for
+# the other languages.
+DFG_java = DFG_ruby = DFG_go = DFG_php = DFG_javascript = DFG_csharp = None
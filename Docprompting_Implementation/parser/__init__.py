@@ -0,0 +1,12 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+# Parsing utilities and data flow extraction for syntax and dataflow match.
+
+from .utils import (remove_comments_and_docstrings,
+                    python_comment_and_docstring_spans,
+                    tree_to_token_index,
+                    index_to_code_token,
+                    tree_to_variable_index)
+from .DFG import DFG_python, DFG_java, DFG_ruby, DFG_go, DFG_php, DFG_javascript, DFG_csharp
+from .DFG import python_data_flow
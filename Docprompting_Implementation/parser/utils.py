@@ -0,0 +1,201 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT license.
+
+# Code cleaning and token indexing for syntax and dataflow match, after the
+# CodeXGLUE CodeBLEU parser utilities. Trees are walked with an explicit
+# stack, so deep or very long code cannot hit the recursion limit.
+
+import re
+from io import StringIO
+import tokenize
+
+
+def remove_comments_and_docstrings(source, lang):
+    if lang in ['python']:
+        io_obj = StringIO(source)
+        out = ""
+        prev_toktype = tokenize.INDENT
+        last_lineno = -1
+        last_col = 0
+        for tok in tokenize.generate_tokens(io_obj.readline):
+            token_type = tok[0]
+            token_string = tok[1]
+            start_line, start_col = tok[2]
+            end_line, end_col = tok[3]
+            if start_line > last_lineno:
+                last_col = 0
+            if start_col > last_col:
+                out += (" " * (start_col - last_col))
+            if token_type == tokenize.COMMENT:
+                pass
+            elif token_type == tokenize.STRING:
+                # A string is a docstring when it starts a statement.
+                if prev_toktype != tokenize.INDENT:
+                    if prev_toktype != tokenize.NEWLINE:
+                        if start_col > 0:
+                            out += token_string
+            else:
+                out += token_string
+            prev_toktype = token_type
+            last_col = end_col
+            last_lineno = end_line
+        temp = []
+        for x in out.split('\n'):
+            if x.strip() != "":
+                temp.append(x)
+        return '\n'.join(temp)
+    elif lang in ['ruby']:
+        return source
+    else:
+        def replacer(match):
+            s = match.group(0)
+            if s.startswith('/'):
+                return " "  # note: a space and not an empty string
+            else:
+                return s
+        pattern = re.compile(
+            r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
+            re.DOTALL | re.MULTILINE
+        )
+        temp = []
+        for x in re.sub(pattern, replacer, source).split('\n'):
+            if x.strip() != "":
+                temp.append(x)
+        return '\n'.join(temp)
+
+
+# What tokenize emitted last, as far as remove_comments_and_docstrings() cares.
+_NEWLINE, _NL, _INDENT, _DEDENT, _COMMENT, _OTHER = range(6)
+
+_STRING_PREFIX = re.compile(rb'[A-Za-z]*')
+
+
+def python_comment_and_docstring_spans(root_node, code):
+    """
+    The byte ranges remove_comments_and_docstrings() drops from Python code,
+    found from its tree-sitter tree instead of tokenizing it again: comments,
+    strings starting a logical line or a line (docstrings), and the line
+    continuations it joins. The token sequence of tokenize is replayed from
+    the leaves of the tree.
+    :param root_node: root of an error-free tree of code
+    :param code: the UTF-8 bytes the tree was parsed from
+    :return: sorted (start_byte, end_byte) list, or None where tokenize would
+        fail or count columns differently (tabs, form feeds, carriage returns,
+        inconsistent dedents, a trailing backslash)
+    """
+    if b'\t' in code or b'\f' in code or b'\r' in code:
+        return None
+    # Since Python 3.12 f-strings are several tokens, none of them a STRING.
+    fstring_tokens = hasattr(tokenize, 'FSTRING_START')
+    spans = []
+    prev = _INDENT
+    parens = 0
+    indents = [0]
+    first = True  # no token yet
+    comment_line = False  # the last token is a comment on a line of its own
+    last_end = 0
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        node_type = node.type
+        if node.child_count and node_type != 'string':
+            stack.extend(reversed(node.children))
+            continue
+        if node_type == 'line_continuation':
+            continue  # handled with the whitespace before the next token
+        start, end = node.start_byte, node.end_byte
+
+        newlines = code.count(b'\n', last_end, start)
+        continued = False
+        if newlines and code.find(b'\\', last_end, start) != -1:
+            # Backslash continuations, which tokenize joins with the next line.
+            if first or code.count(b'\\\n', last_end, start) != newlines:
+                return None
+            continued = True
+            pos = code.find(b'\\\n', last_end, start)
+            while pos != -1:
+                spans.append((pos, pos + 2))
+                pos = code.find(b'\\\n', pos + 2, start)
+        starts_line = False
+        if not continued and (newlines or first):
+            starts_line = True
+            col = start - code.rfind(b'\n', 0, start) - 1
+            if not first:
+                # The end of the last token's line, then any blank lines.
+                prev = _NL if parens or comment_line or newlines > 1 else _NEWLINE
+            elif newlines:
+                prev = _NL
+            if not parens and node_type != 'comment':
+                if col > indents[-1]:
+                    indents.append(col)
+                    prev = _INDENT
+                elif col < indents[-1]:
+                    while col < indents[-1]:
+                        indents.pop()
+                    if col != indents[-1]:
+                        return None
+                    prev = _DEDENT
+
+        if node_type == 'comment':
+            spans.append((start, end))
+            prev = _COMMENT
+        elif node_type == 'string' and not (fstring_tokens and b'f' in _STRING_PREFIX.match(code, start).group().lower()):
+            if prev == _INDENT or prev == _NEWLINE or start == 0 or code[start - 1:start] == b'\n':
+                spans.append((start, end))
+            prev = _OTHER
+        else:
+            if node_type in ('(', '[', '{'):
+                parens += 1
+            elif node_type in (')', ']', '}'):
+                parens -= 1
+            prev = _OTHER
+        comment_line = starts_line and node_type == 'comment'
+        first = False
+        last_end = end
+    if code.find(b'\\', last_end) != -1:
+        return None
+    return spans
+
+
+def _iter_tokens(root_node):
+    # The token nodes under root_node from left to right: leaves and whole
+    # strings, but not comments.
+    stack = [root_node]
+    while stack:
+        node = stack.pop()
+        node_type = node.type
+        if (node.child_count == 0 or node_type == 'string') and node_type != 'comment':
+            yield node
+        else:
+            stack.extend(reversed(node.children))
+
+
+def tree_to_token_index(root_node):
+    """(start_point, end_point) of every code token under root_node, in order."""
+    return [(node.start_point, node.end_point) for node in _iter_tokens(root_node)]
+
+
+def tree_to_variable_index(root_node, index_to_code):
+    """tree_to_token_index() of the tokens that are not keywords or punctuation."""
+    indexes = []
+    for node in _iter_tokens(root_node):
+        index = (node.start_point, node.end_point)
+        _, code = index_to_code[index]
+        if node.type != code:
+            indexes.append(index)
+    return indexes
+
+
+def index_to_code_token(index, code):
+    """The text of a token, given its index and the code split into lines."""
+    start_point = index[0]
+    end_point = index[1]
+    if start_point[0] == end_point[0]:
+        s = code[start_point[0]][start_point[1]:end_point[1]]
+    else:
+        s = ""
+        s += code[start_point[0]][start_point[1]:]
+        for i in range(start_point[0] + 1, end_point[0]):
+            s += code[i]
+        s += code[end_point[0]][:end_point[1]]
+    return s
@@ -0,0 +1,53 @@
+# Per-language tree-sitter parsers reused across calls and threads.
+#
+# Loading a grammar and building a Parser on every metric call is wasted work
+# once scoring happens per sentence. Languages are loaded once per process and
+# each thread lazily gets its own Parser per language, since a tree-sitter
+# Parser must not be shared by threads parsing concurrently.
+
+import threading
+from functools import lru_cache
+
+from tree_sitter import Parser
+from tree_sitter_languages import get_language
+
+# Maps the --lang names accepted by calc_code_bleu.py (and the keys of
+# dfg_function) to the names used by tree-sitter-languages.
+LANGUAGE_NAMES = {
+    'python': 'python',
+    'java': 'java',
+    'js': 'javascript',
+    'javascript': 'javascript',
+    'c_sharp': 'c_sharp',
+    'php': 'php',
+    'go': 'go',
+    'ruby': 'ruby',
+}
+
+_local = threading.local()
+
+
+def language_name(lang):
+    """Returns the tree-sitter-languages name for lang."""
+    return LANGUAGE_NAMES.get(lang, lang)
+
+
+@lru_cache(maxsize=None)
+def load_language(lang):
+    return get_language(language_name(lang))
+
+
+def get_parser(lang):
+    """
+    Returns the calling thread's parser for lang, creating it on first use.
+    Raises whatever tree-sitter-languages raises for an unknown language.
+    """
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    parser = parsers.get(lang)
+    if parser is None:
+        parser = Parser()
+        parser.set_language(load_language(lang))
+        parsers[lang] = parser
+    return parser
@@ -0,0 +1,131 @@
+# Shared preprocessing for syntax and dataflow match.
+#
+# Both metrics need the same comment-stripped code and the same tree-sitter
+# tree for every reference and candidate. ParsedCorpus cleans and parses each
+# unique snippet once (keyed by a hash of its content) so the two metrics can
+# share the result instead of repeating the work per pair. map_snippets()
+# runs a per-snippet function once over the unique snippets of a corpus.
+
+import hashlib
+
+from parser import remove_comments_and_docstrings, python_comment_and_docstring_spans
+
+
+def code_hash(code):
+    """Stable content hash used to deduplicate code snippets."""
+    return hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+
+def clean_code(code, lang):
+    # Falls back to the original code when cleaning fails, matching what
+    # syntax_match and dataflow_match did individually.
+    try:
+        return remove_comments_and_docstrings(code, lang)
+    except Exception:
+        return code
+
+
+def _splice_out(code, spans):
+    # code without the byte ranges in spans, and without the lines left blank,
+    # as remove_comments_and_docstrings() returns it.
+    pieces = []
+    pos = 0
+    for start, end in spans:
+        pieces.append(code[pos:start])
+        pos = end
+    pieces.append(code[pos:])
+    return '\n'.join(line for line in b''.join(pieces).decode('utf8').split('\n') if line.strip() != '')
+
+
+def clean_and_parse(code, lang, ts_parser):
+    """
+    Cleans code as clean_code() and parses it.
+    Python code is parsed first and its comments and docstrings are found in
+    the tree, so the code is not tokenized again; it is only parsed a second
+    time if it has any. Code that does not parse without errors is cleaned
+    by clean_code().
+    :param ts_parser: tree-sitter Parser with the language of lang set
+    :return: (cleaned code, tree or None if parsing failed); the cleaned code
+        is the text the tree was parsed from
+    """
+    if lang == 'python':
+        try:
+            data = bytes(code, 'utf8')
+            tree = ts_parser.parse(data)
+        except Exception:
+            tree = None
+        if tree is not None and not tree.root_node.has_error:
+            spans = python_comment_and_docstring_spans(tree.root_node, data)
+            if spans == []:
+                return code, tree
+            if spans is not None:
+                cleaned = _splice_out(data, spans)
+                return cleaned, ts_parser.parse(bytes(cleaned, 'utf8'))
+
+    cleaned = clean_code(code, lang)
+    try:
+        tree = ts_parser.parse(bytes(cleaned, 'utf8'))
+    except Exception:
+        tree = None
+    return cleaned, tree
+
+
+class ParsedCorpus:
+    """Cleaned code and tree-sitter tree for every unique snippet of a corpus."""
+
+    def __init__(self, lang, ts_parser):
+        self.lang = lang
+        self.ts_parser = ts_parser
+        self.snippets = {}  # Key = code hash, value = (cleaned code, tree or None).
+
+    def add(self, code):
+        key = code_hash(code)
+        if key not in self.snippets:
+            self.snippets[key] = clean_and_parse(code, self.lang, self.ts_parser)
+        return key
+
+    def get(self, code):
+        """Returns (cleaned code, tree) for code, parsing it if it is new."""
+        return self.snippets[self.add(code)]
+
+    def __len__(self):
+        return len(self.snippets)
+
+
+def parse_corpus(references, candidates, lang, ts_parser):
+    """
+    Cleans and parses every unique reference and candidate once.
+    :param references: list of reference lists, one list per candidate
+    :param candidates: list of candidate code strings
+    :param lang: programming language name
+    :param ts_parser: tree-sitter Parser with the language already set
+    :return: ParsedCorpus shared by corpus_syntax_match and corpus_dataflow_match
+    """
+    parsed = ParsedCorpus(lang, ts_parser)
+    for references_sample, candidate in zip(references, candidates):
+        parsed.add(candidate)
+        for reference in references_sample:
+            parsed.add(reference)
+    return parsed
+
+
+def _unique_snippets(references, candidates):
+    snippets = {}
+    for references_sample, candidate in zip(references, candidates):
+        snippets.setdefault(code_hash(candidate), candidate)
+        for reference in references_sample:
+            snippets.setdefault(code_hash(reference), reference)
+    return snippets
+
+
+def map_snippets(references, candidates, function):
+    """
+    Applies function to every unique reference and candidate once, in the
+    calling thread. A thread pool would not help: the pinned tree-sitter
+    binding (0.21) holds the GIL while it parses, so threads never parse
+    concurrently. Corpora are scored in parallel by sharding them across
+    processes instead (calc_code_bleu.py --workers).
+    :return: dict of function(code) keyed by code_hash(code)
+    """
+    snippets = _unique_snippets(references, candidates)
+    return {key: function(code) for key, code in snippets.items()}
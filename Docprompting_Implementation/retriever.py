@@ -1,17 +1,24 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-import json
+
+from doc_store import open_doc_store
 
 class Retriever:
     def __init__(self, doc_path):
-        with open(doc_path, 'r') as f:
-            self.docs = json.load(f)
-        self.contents = [doc['content'] for doc in self.docs]
-        self.vectorizer = TfidfVectorizer().fit(self.contents)
-        self.doc_vectors = self.vectorizer.transform(self.contents)
+        # Contents stay in the memory-mapped store (see doc_store.py); only
+        # the TF-IDF matrix is held in memory.
+        self.store = open_doc_store(doc_path)
+        self.vectorizer = TfidfVectorizer()
+        self.doc_vectors = self.vectorizer.fit_transform(self.store.contents())
+
+    def retrieve_indices(self, nl_intent, top_k=2):
+        return self.retrieve_batch_indices([nl_intent], top_k)[0]
+
+    def retrieve_batch_indices(self, nl_intents, top_k=2):
+        # All queries are scored against the corpus in one matrix product.
+        query_vecs = self.vectorizer.transform(nl_intents)
+        scores = cosine_similarity(query_vecs, self.doc_vectors)
+        return [[int(i) for i in row.argsort()[::-1][:top_k]] for row in scores]
 
     def retrieve(self, nl_intent, top_k=2):
-        query_vec = self.vectorizer.transform([nl_intent])
-        scores = cosine_similarity(query_vec, self.doc_vectors).flatten()
-        top_indices = scores.argsort()[::-1][:top_k]
-        return [self.docs[i]['content'] for i in top_indices]
+        return [self.store.content(i) for i in self.retrieve_indices(nl_intent, top_k)]
@@ -1,24 +1,13 @@
 # Copyright (c) Microsoft Corporation. 
 # Licensed under the MIT license.
 
-# Assuming DFG functions are correctly defined in a 'parser' directory/module
-# If DFG_python etc. are in the same directory or a 'parser.py' file, adjust import
-try:
-    from .parser import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
-    from .parser import (remove_comments_and_docstrings,
-                       tree_to_token_index,
-                       index_to_code_token,
-                       tree_to_variable_index)
-except ImportError: # Fallback if running as a script and parser is a sibling directory
-    from parser.DFG import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
-    from parser.utils import (remove_comments_and_docstrings,
-                              tree_to_token_index,
-                              index_to_code_token,
-                              tree_to_variable_index)
-
-
-from tree_sitter import Language, Parser
-from tree_sitter_languages import get_language # MODIFICATION: Import get_language
+from parser import DFG_python,DFG_java,DFG_ruby,DFG_go,DFG_php,DFG_javascript,DFG_csharp
+
+import hashlib
+from collections import Counter
+
+from parser_pool import get_parser
+from preprocess import code_hash, map_snippets, parse_corpus
 
 dfg_function={
     'python':DFG_python,
@@ -30,6 +19,158 @@ dfg_function={
     'c_sharp':DFG_csharp, # Note: tree-sitter-languages uses 'c_sharp' for C#
 }
 
+def get_all_sub_trees(root_node):
+    if root_node is None: # Handle cases where parsing might have failed subtly
+        return []
+    node_stack = []
+    sub_tree_sexp_list = []
+    depth = 1
+    node_stack.append([root_node, depth])
+    while len(node_stack) != 0:
+        cur_node, cur_depth = node_stack.pop()
+        sub_tree_sexp_list.append([cur_node.sexp(), cur_depth])
+        # Original code had a bug: it would not traverse children if they themselves had no children.
+        # It should traverse all children to add them to the stack.
+        for child_node in cur_node.children:
+            # Only add to stack if it's a node that can be further expanded meaningfully
+            # For s-expression matching, typically all children are considered parts of subtrees
+            # The original condition `if len(child_node.children) != 0:` might be too restrictive.
+            # Let's add all children to the stack. The depth logic will handle tree structure.
+            # However, the original intent might have been to only consider non-terminal subtrees.
+            # Sticking to original logic for now, but this is a point of potential improvement/difference.
+            if len(child_node.children) != 0: # Original condition
+               depth = cur_depth + 1 # This depth increment seems off, should be independent of child's children
+               node_stack.append([child_node, cur_depth + 1]) # Corrected depth increment
+            else: # If it's a leaf in terms of complex subtrees, still add its s-expression
+                sub_tree_sexp_list.append([child_node.sexp(), cur_depth + 1])
+
+
+    return sub_tree_sexp_list
+
+def sub_tree_sexps(root_node):
+    # The s-expressions of all subtrees, i.e. the syntax features of one snippet.
+    return [x[0] for x in get_all_sub_trees(root_node)]
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _node_head(node, node_type):
+    # How a node opens its s-expression when printed inside its parent.
+    if node.is_missing:
+        return (b'M' if node.is_named else b'm') + node_type.encode()
+    if node_type == 'ERROR' and node.child_count == 0 and node.end_byte > node.start_byte:
+        # Printed as (UNEXPECTED 'c') with the first character of the text.
+        return b'U' + node.text.decode('utf8', 'replace')[:1].encode()
+    return b'S' + node_type.encode()
+
+# Key of the childless visible and anonymous nodes of each type, the same for
+# all but the special cases handled in sub_tree_hashes().
+_leaf_keys = {}
+
+def _printed_key(node, body):
+    # The key of an aliased or empty node, from the s-expression it prints on
+    # its own: the key of any other subtree printing the same. Its parent
+    # prints it by its type, but on its own it shows the grammar symbol it
+    # stands for, e.g. ("print") for a soft keyword aliased to an identifier,
+    # (interpolation ...) for a format_expression, or ("_newline") for an
+    # empty block. A hidden symbol is followed by the node's children.
+    sexp = node.sexp()
+    if body:
+        if sexp.startswith('("'):
+            return _digest(b'l' + sexp.encode())
+        return _digest(b'r' + _node_head(node, node.grammar_name) + b'\0' + body)
+    if sexp.startswith('("') and sexp.endswith('")'):
+        return _digest(b'a' + sexp[2:-2].encode())
+    if sexp.startswith('(') and sexp.endswith(')') and ' ' not in sexp:
+        return _digest(b'rS' + sexp[1:-1].encode() + b'\0')
+    return _digest(b'l' + sexp.encode())
+
+def sub_tree_hashes(root_node):
+    """
+    Structural hashes of all subtrees, i.e. the syntax features of one snippet,
+    computed bottom-up in one post-order traversal. Two subtrees get the same
+    key when their s-expressions (see sub_tree_sexps()) are the same, so
+    matching keys matches s-expressions without printing every subtree.
+    :return: the number of subtrees with each key
+    :rtype: Counter
+    """
+    keys = Counter()
+    if root_node is None:
+        return keys
+    digest = _digest
+    leaf_keys = _leaf_keys
+    # A frame per node on the path from the root: the node, the field name it
+    # has in its parent, and what its s-expression prints for its children as
+    # (field, key) pairs. Anonymous nodes print nothing themselves but their
+    # visible descendants, which therefore are spliced into the parent.
+    cursor = root_node.walk()
+    frames = [(cursor.node, None, [])]
+    while True:
+        if cursor.goto_first_child():
+            frames.append((cursor.node, cursor.field_name, []))
+            continue
+        while True:
+            node, field, children = frames.pop()
+            node_type = node.type
+            missing = node.is_missing
+            visible = missing or node.is_named
+            aliased = node.grammar_name != node_type
+            if children or node.child_count:
+                body = b''.join([(child_field or b'') + b'\0' + key for child_field, key in children])
+                if visible:
+                    key = digest(b'r' + _node_head(node, node_type) + b'\0' + body)
+                else:
+                    key = digest(b'o' + node_type.encode() + b'\0' + body)
+                keys[_printed_key(node, body) if aliased else key] += 1
+            elif not visible:
+                if aliased:
+                    keys[_printed_key(node, b'')] += 1
+                else:
+                    key = leaf_keys.get((node_type, False))
+                    if key is None:
+                        key = leaf_keys[node_type, False] = digest(b'a' + node_type.encode())
+                    keys[key] += 1
+            elif missing or node_type == 'ERROR':
+                key = digest(b'r' + _node_head(node, node_type) + b'\0')
+                keys[key] += 1
+            else:
+                key = leaf_keys.get((node_type, True))
+                if key is None:
+                    key = leaf_keys[node_type, True] = digest(b'rS' + node_type.encode() + b'\0')
+                keys[_printed_key(node, b'') if aliased or node.start_byte == node.end_byte else key] += 1
+
+            if not frames:
+                return keys
+            field = field.encode() if field else None
+            if visible:
+                frames[-1][2].append((field, key))
+            else:
+                frames[-1][2].extend((child_field if child_field is not None else field, child_key)
+                                     for child_field, child_key in children)
+            if cursor.goto_next_sibling():
+                frames.append((cursor.node, cursor.field_name, []))
+                break
+            cursor.goto_parent()
+
+def count_sub_tree_hash_matches(ref_hashes, cand_hashes):
+    # count_sub_tree_matches() of sub_tree_hashes() multisets: every reference
+    # subtree whose key occurs in the candidate matches.
+    match_count = 0
+    for key, count in ref_hashes.items():
+        if key in cand_hashes:
+            match_count += count
+    return match_count, sum(ref_hashes.values())
+
+def count_sub_tree_matches(ref_sexps, cand_sexps):
+    # Returns (match_count, total_count) for one reference/candidate pair.
+    # Filter out very simple/common s-expressions if needed, or specific types
+    # For now, direct matching as per original script's intent
+    match_count = 0
+    for sub_tree_sexp in ref_sexps:
+        if sub_tree_sexp in cand_sexps:
+             match_count += 1
+    return match_count, len(ref_sexps)
+
 def calc_syntax_match(references, candidate, lang):
     # Ensure references is a list of lists for corpus_syntax_match
     if isinstance(references, str):
@@ -38,104 +179,55 @@ def calc_syntax_match(references, candidate, lang):
         references = [references] # Make it list of lists if it's a flat list of ref strings
     return corpus_syntax_match(references, [candidate], lang)
 
-def corpus_syntax_match(references, candidates, lang):   
-    parser = Parser()
-    
-    # MODIFICATION: Load language using tree-sitter-languages
+def corpus_syntax_match(references, candidates, lang, parsed=None):
+    match_count, total_count = corpus_syntax_match_stats(references, candidates, lang, parsed)
+    return syntax_match_from_stats((match_count, total_count))
+
+def syntax_match_from_stats(stats):
+    match_count, total_count = stats
+    if total_count == 0:
+        return 0.0 # Avoid division by zero if no reference subtrees were processed
+        
+    score = match_count / total_count
+    return score
+
+def _tree_hashes(tree):
+    return sub_tree_hashes(tree.root_node) if tree is not None else None
+
+def corpus_syntax_match_stats(references, candidates, lang, parsed=None):
+    # Returns (match_count, total_count). Counts of disjoint parts of a corpus
+    # add up to the counts of the whole corpus.
+    # Parsers are pooled per language and thread (see parser_pool.py)
     try:
-        # Ensure 'lang' matches the names used by tree-sitter-languages
-        # Common names: 'python', 'java', 'ruby', 'go', 'php', 'javascript', 'c_sharp'
-        # The 'lang' variable from args.lang in calc_code_bleu.py should be one of these.
-        language_to_load = lang
-        if lang == 'c_sharp': # tree_sitter_languages might expect 'c_sharp' or 'c-sharp'
-            language_to_load = 'c_sharp' # Adjust if your lang string is different (e.g. 'csharp')
-        elif lang == 'javascript':
-            language_to_load = 'javascript' # or 'typescript' if you want to handle ts/tsx
-            
-        selected_language = get_language(language_to_load)
-        parser.set_language(selected_language)
+        parser = get_parser(lang)
     except Exception as e:
         print(f"Error setting language '{lang}' using tree-sitter-languages: {e}")
         print(f"  Please ensure 'tree-sitter' and 'tree-sitter-languages' are installed.")
         print(f"  Supported languages include 'python', 'java', 'javascript', 'c_sharp', 'ruby', 'go', 'php'.")
         print(f"  Ensure your --lang argument (currently '{lang}') matches one of these.")
         # Depending on desired behavior, you might return a default score or re-raise
-        return 0.0 # Default score indicating syntax match failure
+        return 0, 0 # No counts, i.e. a score of 0 indicating syntax match failure
 
     match_count = 0
     total_count = 0
 
+    # Comment/docstring removal, parsing and hashing happen once per unique
+    # snippet; a None hash multiset means parsing failed.
+    if parsed is None:
+        parsed = parse_corpus(references, candidates, lang, parser)
+    hashes = map_snippets(references, candidates, lambda code: _tree_hashes(parsed.get(code)[1]))
+
     for i in range(len(candidates)):
         references_sample = references[i] # This is a list of reference strings for the i-th candidate
-        candidate = candidates[i] 
-        
+        candidate_hashes = hashes[code_hash(candidates[i])]
+
         for reference in references_sample:
-            # Use the 'lang' parameter for remove_comments_and_docstrings
-            # The original code hardcoded 'java', which is likely an error.
-            try:
-                candidate_cleaned = remove_comments_and_docstrings(candidate, lang)
-            except Exception as e_cand:
-                # print(f"Warning: Could not remove comments/docstrings from candidate for lang '{lang}': {e_cand}")
-                candidate_cleaned = candidate # Use original if cleaning fails
-            try:
-                reference_cleaned = remove_comments_and_docstrings(reference, lang)
-            except Exception as e_ref:
-                # print(f"Warning: Could not remove comments/docstrings from reference for lang '{lang}': {e_ref}")
-                reference_cleaned = reference # Use original if cleaning fails
-
-            try:
-                candidate_tree = parser.parse(bytes(candidate_cleaned, 'utf8')).root_node
-                reference_tree = parser.parse(bytes(reference_cleaned, 'utf8')).root_node
-            except Exception as e_parse:
-                # print(f"Warning: Tree-sitter parsing error for lang '{lang}': {e_parse}")
-                # If parsing fails, we can't compare subtrees for this pair
+            reference_hashes = hashes[code_hash(reference)]
+            if candidate_hashes is None or reference_hashes is None:
                 continue # Skip to the next reference or candidate
 
-            def get_all_sub_trees(root_node):
-                if root_node is None: # Handle cases where parsing might have failed subtly
-                    return []
-                node_stack = []
-                sub_tree_sexp_list = []
-                depth = 1
-                node_stack.append([root_node, depth])
-                while len(node_stack) != 0:
-                    cur_node, cur_depth = node_stack.pop()
-                    sub_tree_sexp_list.append([cur_node.sexp(), cur_depth])
-                    # Original code had a bug: it would not traverse children if they themselves had no children.
-                    # It should traverse all children to add them to the stack.
-                    for child_node in cur_node.children:
-                        # Only add to stack if it's a node that can be further expanded meaningfully
-                        # For s-expression matching, typically all children are considered parts of subtrees
-                        # The original condition `if len(child_node.children) != 0:` might be too restrictive.
-                        # Let's add all children to the stack. The depth logic will handle tree structure.
-                        # However, the original intent might have been to only consider non-terminal subtrees.
-                        # Sticking to original logic for now, but this is a point of potential improvement/difference.
-                        if len(child_node.children) != 0: # Original condition
-                           depth = cur_depth + 1 # This depth increment seems off, should be independent of child's children
-                           node_stack.append([child_node, cur_depth + 1]) # Corrected depth increment
-                        else: # If it's a leaf in terms of complex subtrees, still add its s-expression
-                            sub_tree_sexp_list.append([child_node.sexp(), cur_depth + 1])
-
-
-                return sub_tree_sexp_list
-
-            cand_sexps = [x[0] for x in get_all_sub_trees(candidate_tree)]
-            ref_sexps_with_depth = get_all_sub_trees(reference_tree) # Keep depth for potential future use
-
-            if not ref_sexps_with_depth: # If reference has no subtrees (e.g., empty or parse error)
-                continue
-
-            # Filter out very simple/common s-expressions if needed, or specific types
-            # For now, direct matching as per original script's intent
-            
-            # Count matches
-            for sub_tree_sexp, depth in ref_sexps_with_depth:
-                if sub_tree_sexp in cand_sexps:
-                     match_count += 1
-            total_count += len(ref_sexps_with_depth)
+            pair_match_count, pair_total_count = count_sub_tree_hash_matches(reference_hashes, candidate_hashes)
+            match_count += pair_match_count
+            total_count += pair_total_count
     
-    if total_count == 0:
-        return 0.0 # Avoid division by zero if no reference subtrees were processed
-        
-    score = match_count / total_count
-    return score
\ No newline at end of file
+    return match_count, total_count
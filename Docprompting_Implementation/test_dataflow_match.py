@@ -0,0 +1,66 @@
+# test_dataflow_match.py
+# The fused data flow extraction of get_data_flow() must give the normalized
+# data flow of the separate CodeXGLUE passes. Run with:
+# python -m pytest test_dataflow_match.py
+import glob
+import itertools
+import os
+
+import pytest
+
+from dataflow_match import get_data_flow, normalize_dataflow
+from parser import DFG_python
+from parser_pool import get_parser
+
+# Real code in which an assignment pairs the parts of a string element-wise
+# with the parts of its other side, which makes the separate passes fail.
+SNIPPETS = [
+    """class NNTPError(Exception):
+    \"\"\"Base class for all nntplib exceptions\"\"\"
+    def __init__(self, *args):
+        Exception.__init__(self, *args)
+        try:
+            self.response = args[0]
+        except IndexError:
+            self.response = 'No response given'
+""",
+    """def open(filename):
+    buffer = _builtin_open(filename, 'rb')
+    try:
+        encoding, lines = detect_encoding(buffer.readline)
+        buffer.seek(0)
+        text = TextIOWrapper(buffer, encoding, line_buffering=True)
+        text.mode = 'r'
+        return text
+    except:
+        buffer.close()
+        raise
+""",
+    "x.y = f'{a}{b}'\nz = x.y + a",
+    "a, b = 'x', 'y'\nc = a + b",
+    "def f(n):\n    total = 0\n    for i in range(n):\n        total += i\n    return total",
+]
+
+
+def _definitions():
+    # Top-level functions and classes of this directory's modules, as real code.
+    parser = get_parser('python')
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            root = parser.parse(f.read()).root_node
+        for node in root.children:
+            if node.type in ('function_definition', 'class_definition'):
+                yield node.text.decode('utf-8')
+
+
+@pytest.mark.parametrize('code', SNIPPETS + list(itertools.islice(_definitions(), 200)))
+def test_fused_equals_separate(code):
+    ts_parser = get_parser('python')
+    separate = [ts_parser, lambda *dfg_args: DFG_python(*dfg_args)]  # not in fused_data_flow_function
+    fused = [ts_parser, DFG_python]
+    assert normalize_dataflow(get_data_flow(code, fused)) == normalize_dataflow(get_data_flow(code, separate))
+
+
+def test_split_string_assignment_has_no_data_flow():
+    ts_parser = get_parser('python')
+    assert get_data_flow("self.response = 'No response given'", [ts_parser, DFG_python]) == []
@@ -0,0 +1,68 @@
+# test_syntax_match.py
+# sub_tree_hashes() must match exactly what the s-expression matching of
+# sub_tree_sexps() matches. Run with: python -m pytest test_syntax_match.py
+import glob
+import itertools
+import os
+from collections import Counter
+
+import pytest
+
+from parser_pool import get_parser
+from syntax_match import count_sub_tree_hash_matches, count_sub_tree_matches, sub_tree_hashes, sub_tree_sexps
+
+# Code whose nodes print differently on their own than inside their parent:
+# soft keywords aliased to identifiers, aliased operators and patterns,
+# hidden symbols, empty and missing nodes.
+SNIPPETS = [
+    "x = type(y)",
+    "x = f(y)",
+    "print(x)\nprint('a', end='')",
+    "exec(code, globals())\nmatch = exec",
+    "def match(match):\n    return match(type)",
+    "match command.split():\n    case [action, *rest]:\n        print(action)\n    case _:\n        pass",
+    "if a is not b and c not in d:\n    x = a is b",
+    "s = f'{value!r:>{width}} {type(value)}'",
+    "while node.next: node = node.next",
+    "try:\n    run()\nexcept (OSError, ValueError) as e:\n    print(e)",
+    "class A:\n    def f(self):\n",
+    "def f(x:\n    return type(x",
+    "for i in range(10): print(i); exec(i)",
+]
+
+
+def _definitions():
+    # Top-level statements of this directory's modules, as real code.
+    parser = get_parser('python')
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            root = parser.parse(f.read()).root_node
+        for node in root.children:
+            if node.type in ('function_definition', 'class_definition'):
+                yield node.text.decode('utf-8')
+
+
+@pytest.fixture(scope='module')
+def features():
+    parser = get_parser('python')
+    codes = SNIPPETS + list(itertools.islice(_definitions(), 300))
+    return [(code, sub_tree_sexps(parser.parse(code.encode()).root_node),
+             sub_tree_hashes(parser.parse(code.encode()).root_node)) for code in codes]
+
+
+def test_hashes_count_subtrees_like_sexps(features):
+    for code, sexps, hashes in features:
+        assert sorted(Counter(sexps).values()) == sorted(hashes.values()), code
+
+
+def test_hash_matches_equal_sexp_matches(features):
+    for (ref, ref_sexps, ref_hashes), (cand, cand_sexps, cand_hashes) in itertools.permutations(features[:80], 2):
+        assert count_sub_tree_hash_matches(ref_hashes, cand_hashes) == count_sub_tree_matches(ref_sexps, cand_sexps), \
+            (ref, cand)
+
+
+def test_aliased_identifier():
+    parser = get_parser('python')
+    ref, cand = parser.parse(b"x = type(y)").root_node, parser.parse(b"x = f(y)").root_node
+    assert count_sub_tree_hash_matches(sub_tree_hashes(ref), sub_tree_hashes(cand)) == \
+        count_sub_tree_matches(sub_tree_sexps(ref), sub_tree_sexps(cand)) == (10, 11)
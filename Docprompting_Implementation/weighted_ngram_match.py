@@ -19,6 +19,7 @@ import warnings
 from collections import Counter
 
 from utils import ngrams
+import ngram_match
 import pdb
 
 
@@ -144,6 +145,32 @@ def corpus_bleu(
     :return: The corpus-level BLEU score.
     :rtype: float
     """
+    stats = corpus_bleu_stats(list_of_references, hypotheses, len(weights))
+    # Smoothing methods 4-7 look at the last hypothesis and its references,
+    # as they did when the statistics were collected inline.
+    references = list_of_references[-1] if list_of_references else []
+    hypothesis = hypotheses[-1] if hypotheses else []
+    return corpus_bleu_from_stats(
+        stats, weights, smoothing_function, auto_reweigh, references, hypothesis
+    )
+
+
+def corpus_bleu_stats(list_of_references, hypotheses, max_n=4):
+    """
+    Collect the sufficient statistics of corpus_bleu(): the numerators and
+    denominators of every ngram order up to max_n plus the hypothesis and
+    closest reference lengths. The statistics of disjoint parts of a corpus
+    sum to those of the whole corpus (see merge_bleu_stats()), so they can be
+    computed per shard and reduced into the same corpus score.
+    :param list_of_references: a corpus of lists of reference sentences, w.r.t. hypotheses
+    :type list_of_references: list(list(list(str)))
+    :param hypotheses: a list of hypothesis sentences
+    :type hypotheses: list(list(str))
+    :param max_n: the highest ngram order
+    :type max_n: int
+    :return: (p_numerators, p_denominators, hyp_lengths, ref_lengths)
+    :rtype: tuple(Counter, Counter, int, int)
+    """
     # Before proceeding to compute BLEU, perform sanity checks.
 
     p_numerators = Counter()  # Key = ngram order, and value = no. of ngram matches.
@@ -156,12 +183,17 @@ def corpus_bleu(
 
     # Iterate through each hypothesis and their corresponding references.
     for references, hypothesis in zip(list_of_references, hypotheses):
-        # For each order of ngram, calculate the numerator and
-        # denominator for the corpus-level modified precision.
-        for i, _ in enumerate(weights, start=1):
-            p_i_numeraotr, p_i_denominator = modified_recall(references, hypothesis, i)
-            p_numerators[i] += p_i_numeraotr
-            p_denominators[i] += p_i_denominator
+        # Calculate the numerator and denominator for the corpus-level
+        # modified recall of every order of ngram in one pass.
+        match = ngram_match.match_tokens(
+            [reference for reference, _ in references], hypothesis,
+            [weights for _, weights in references], max_n, precision=False
+        )
+        for i in range(1, max_n + 1):
+            # Keyword weights make unigram counts floats; accumulating them
+            # exactly keeps the corpus sum independent of how it is sharded.
+            p_numerators[i] += Fraction(match.r_numerators[i - 1])
+            p_denominators[i] += Fraction(match.r_denominators[i - 1])
 
         # Calculate the hypothesis length and the closest reference length.
         # Adds them to the corpus-level hypothesis and reference counts.
@@ -169,6 +201,42 @@ def corpus_bleu(
         hyp_lengths += hyp_len
         ref_lengths += closest_ref_length(references, hyp_len)
 
+    return p_numerators, p_denominators, hyp_lengths, ref_lengths
+
+
+def merge_bleu_stats(stats, other):
+    """
+    Add up two sets of statistics returned by corpus_bleu_stats().
+    :rtype: tuple(Counter, Counter, int, int)
+    """
+    p_numerators = Counter(stats[0])
+    p_numerators.update(other[0])
+    p_denominators = Counter(stats[1])
+    p_denominators.update(other[1])
+    return p_numerators, p_denominators, stats[2] + other[2], stats[3] + other[3]
+
+
+def corpus_bleu_from_stats(
+    stats,
+    weights=(0.25, 0.25, 0.25, 0.25),
+    smoothing_function=None,
+    auto_reweigh=False,
+    references=None,
+    hypothesis=None,
+):
+    """
+    Calculate the corpus-level BLEU score from corpus_bleu_stats().
+    :param stats: statistics collected for at least len(weights) ngram orders
+    :type stats: tuple(Counter, Counter, int, int)
+    :param references: references of one example, only used by smoothing methods 4-7
+    :type references: list(list(str))
+    :param hypothesis: hypothesis of one example, only used by smoothing methods 4-7
+    :type hypothesis: list(str)
+    :return: The corpus-level BLEU score.
+    :rtype: float
+    """
+    p_numerators, p_denominators, hyp_lengths, ref_lengths = stats
+
     # Calculate corpus-level brevity penalty.
     bp = brevity_penalty(ref_lengths, hyp_lengths)
 
@@ -221,26 +289,55 @@ def modified_recall(references, hypothesis, n):
     # Extracts all ngrams in hypothesis
     # Set an empty Counter if hypothesis is empty.
     # pdb.set_trace()
+    counts = Counter(ngrams(hypothesis, n)) if len(hypothesis) >= n else Counter()
+    references_counts_and_weights = [
+        (Counter(ngrams(reference, n)) if len(reference) >= n else Counter(), weights)
+        for reference, weights in references
+    ]
+    return clipped_recall(references_counts_and_weights, counts, n)
+
+
+def clipped_recall(references_counts_and_weights, counts, n):
+    """
+    Calculate the numerator and denominator of modified_recall() from ngram
+    counts of a single order.
+    :param references_counts_and_weights: The ngram counts and token weights
+        of each reference. Weights are either a dict of the reference's tokens
+        or, for ngram_ids counts, a list indexed by the integer unigram keys
+        (see features.KeywordWeights).
+    :type references_counts_and_weights: list(tuple(Counter, dict or list))
+    :param counts: The ngram counts of the hypothesis.
+    :type counts: Counter
+    :param n: The ngram order; token weights only apply to unigrams.
+    :type n: int
+    :return: The (weighted) clipped ngram matches and reference ngram counts.
+    :rtype: tuple(float, float)
+    """
     numerator = 0
     denominator = 0
 
-    counts = Counter(ngrams(hypothesis, n)) if len(hypothesis) >= n else Counter()
     # Extract a union of references' counts.
     # max_counts = reduce(or_, [Counter(ngrams(ref, n)) for ref in references])
     max_counts = {}
-    for reference_and_weights in references:
-        reference = reference_and_weights[0]
-        weights = reference_and_weights[1]
-        reference_counts = (
-            Counter(ngrams(reference, n)) if len(reference) >= n else Counter()
-        )
+    for reference_counts, weights in references_counts_and_weights:
         # for ngram in reference_counts:
         #     max_counts[ngram] = max(max_counts.get(ngram, 0), counts[ngram])
         clipped_counts = {
             ngram: min(count, counts[ngram]) for ngram, count in reference_counts.items()
         }
         # reweight
-        if n == 1 and len(weights) == len(reference_counts):
+        if n == 1 and isinstance(weights, list):
+            # a weight for every token id: one index per unigram
+            def weighted_sum(weights, counts):
+                sum_counts = 0
+                for ngram, count in counts.items():
+                    sum_counts += count * weights[ngram]
+                return sum_counts
+
+            numerator += weighted_sum(weights, clipped_counts)
+            denominator += max(1, weighted_sum(weights, reference_counts))
+
+        elif n == 1 and len(weights) == len(reference_counts):
             def weighted_sum(weights, counts):
                 sum_counts = 0
                 for ngram, count in counts.items():